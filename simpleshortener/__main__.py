@@ -17,13 +17,41 @@ if __name__ == "__main__":
     parser.add_argument("-u", "--redis-url", dest="redis_url",
                         help="redis url for \"url\" in \"redis://{host}[:port]/{db}\" format")
     parser.add_argument("-s", "--redis-statistics", dest="redis_statistics",
-                        help="redis url for \"statistics\" in \"redis://{host}[:port]/{db}\" format")
+                        help="redis url for \"statistics\" in \"redis://{host}[:port]/{db}\" format, "
+                             "comma separated urls shard the statistics")
     parser.add_argument("-f", "--url-file", dest="url_file",
                         help="JSON file contains url. It can be also provided over http(s)")
     parser.add_argument("-k", "--url-file-expiration", dest="url_file_expiration", type=int,
                         help="url file expiration in hours")
+    parser.add_argument("--url-file-timeout", dest="url_file_timeout", type=int,
+                        help="timeout in seconds to retrieve a remote url file")
     parser.add_argument("-e", "--statistics-expiration", dest="statistics_expiration", type=int,
                         help="expiration of the statistics")
+    parser.add_argument("--url-cache-size", dest="url_cache_size", type=int,
+                        help="max number of short urls cached by each worker")
+    parser.add_argument("--url-cache-ttl", dest="url_cache_ttl", type=int,
+                        help="time to live in seconds of a cached short url")
+    parser.add_argument("--statistics-flush-interval", dest="statistics_flush_interval", type=int,
+                        help="max milliseconds the statistics are kept in memory before being written")
+    parser.add_argument("--statistics-flush-size", dest="statistics_flush_size", type=int,
+                        help="max number of statistics events kept in memory before being written")
+    parser.add_argument("--statistics-queue-size", dest="statistics_queue_size", type=int,
+                        help="max number of statistics events waiting to be aggregated")
+    parser.add_argument("--sync-lock-ttl", dest="sync_lock_ttl", type=int,
+                        help="max seconds a sync can hold the lock shared by all the processes")
+    parser.add_argument("--metrics-cache-ttl", dest="metrics_cache_ttl", type=int,
+                        help="seconds the metrics of an url are cached by each process")
+    parser.add_argument("--url-filter-error-rate", dest="url_filter_error_rate", type=float,
+                        help="false positive rate of the filter of the valid shorts, 0 disables it")
+    parser.add_argument("--url-snapshot", dest="url_snapshot",
+                        help="file of the snapshot of the url table used to serve the redirects without redis")
+    parser.add_argument("--rate-limits", dest="rate_limits",
+                        help="rate limits of the endpoints for each client, "
+                             "e.g. \"redirect=100/1:200,get_metrics=10/60\" for {requests}/{seconds}[:{burst}]")
+    parser.add_argument("--trusted-proxies", dest="trusted_proxies", type=int,
+                        help="number of proxies in front of the service whose X-Forwarded-For is trusted")
+    parser.add_argument("--access-log-sample-rate", dest="access_log_sample_rate", type=float,
+                        help="fraction of the requests written in the access log, 0 disables it")
     parser.add_argument("-d", "--flask-debug", dest="flask_debug", action="store_true",
                         help="expiration of the statistics")
 
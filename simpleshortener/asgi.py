@@ -0,0 +1,15 @@
+from asgiapp import AsgiApp
+from wsgi import load_env
+
+
+def asgi_entry():
+    """
+    Entry point for an ASGI server, e.g. uvicorn --factory asgi:asgi_entry
+    It retrieves the option from envs and return an initialized instance of AsgiApp
+
+    :return an initialized instance of AsgiApp
+    :rtype AsgiApp
+    """
+
+    # Return initialized AsgiApp
+    return AsgiApp(**load_env())
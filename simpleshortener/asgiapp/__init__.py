@@ -0,0 +1,361 @@
+import asyncio
+import contextvars
+import functools
+import gzip
+import hashlib
+import logging
+import math
+import time
+from typing import AsyncIterator, Callable, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+import simplejson as simplejson
+from werkzeug.urls import iri_to_uri
+
+from log import AccessLog, LoggerSetup
+from ratelimit.exceptions import RateLimitExceeded
+from simpleshortener import InvalidMetricsQuery, SimpleShortener, SyncFailed, SyncInProgress, UrlNotFound
+from telemetry import CONTENT_TYPE, ENDPOINT, LATENCY, exposition
+
+# Retrieves logger
+_logger = logging.getLogger(__name__)
+
+# Min size in bytes of a response to be compressed
+_GZIP_MIN_SIZE = 1024
+
+
+class AsgiApp:
+    """
+    ASGI application that serves the redirects and the api of SimpleShortener on an event loop
+
+    The redirects use the async redis client, so a worker can keep thousands of them in flight,
+    the api calls run the blocking methods of SimpleShortener in the default executor
+    """
+
+    def __init__(self,
+                 log_level: Union[int, str] = logging.ERROR,
+                 log_level_modules: Union[int, str] = logging.ERROR,
+                 access_log_sample_rate: float = 0.0,
+                 trusted_proxies: int = 0,
+                 **kwargs):
+        # Init log
+        LoggerSetup(["asgiapp", "simpleshortener"], log_level, log_level_modules=log_level_modules)
+        self._access_log = AccessLog(access_log_sample_rate, classifier=kwargs.get("user_agent_classifier"))
+
+        # Init UUS
+        self._ss = SimpleShortener(**kwargs)
+
+        # Number of proxies in front of the app that append the address of the client to X-Forwarded-For
+        self._trusted_proxies = int(trusted_proxies)
+
+        # Sets url rules for api
+        self._routes = {
+            "/api/v2/sync": self._sync,
+            "/api/v2/url_list": self._url_list,
+            "/api/v2/metrics": self._get_metrics,
+            "/api/v2/metrics/bulk": self._get_bulk_metrics,
+            "/api/v2/cache": self._cache,
+            "/api/v2/export": self._export,
+            "/metrics": self._metrics,
+            "/healthz": self._healthz,
+            "/readyz": self._readyz,
+            "/favicon.ico": self._not_found,
+            "/robots.txt": self._not_found
+        }
+
+        _logger.info("The asgi app is ready")
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            return
+
+        started = time.perf_counter()
+
+        view = self._routes.get(scope["path"], self._redirect)
+
+        # Labels the redis round trips with the endpoint of the request
+        endpoint = view.__name__[1:]
+        ENDPOINT.set(endpoint)
+
+        # Rejects the clients that exceeded the rate limit of the endpoint, the syncs are limited by SimpleShortener
+        if endpoint != "sync" and self._ss.rate_limited(endpoint):
+            try:
+                # The tokens leased by the process are spent on the event loop, only a round trip to redis
+                # runs in the executor
+                client = self._client(scope)
+                if not self._ss.check_rate_limit(endpoint, client, local_only=True):
+                    await self._run(self._ss.check_rate_limit, endpoint, client)
+
+                status, headers, body = await view(scope, receive)
+
+            except RateLimitExceeded as e:
+                status, headers, body = self._too_many_requests(e)
+
+        else:
+            status, headers, body = await view(scope, receive)
+
+        # Logs a sample of the requests with their latency
+        if self._access_log.sampled():
+            self._access_log.log(endpoint, status, time.perf_counter() - started,
+                                 short=scope["path"][1:] if endpoint == "redirect" else None,
+                                 user_agent=self._header(scope, b"user-agent"))
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        })
+        if isinstance(body, bytes):
+            await send({
+                "type": "http.response.body",
+                "body": body
+            })
+            return
+
+        # Streams the chunks of the body
+        async for chunk in body:
+            await send({
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": True
+            })
+
+        await send({
+            "type": "http.response.body",
+            "body": b""
+        })
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                # Flushes the pending statistics
+                await self._run(self._ss.close)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _run(func: Callable, *args):
+        # Runs the function in the context of the request, so its redis round trips keep the endpoint label
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(contextvars.copy_context().run,
+                                                                                        func, *args))
+
+    async def _stream(self, chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Iterates over a blocking iterator in the default executor
+        """
+        while True:
+            chunk = await self._run(next, chunks, None)
+
+            if chunk is None:
+                return
+
+            yield chunk
+
+    @staticmethod
+    def _header(scope: dict, name: bytes) -> Optional[str]:
+        for k, v in scope["headers"]:
+            if k == name:
+                return v.decode("latin-1")
+
+        return None
+
+    def _client(self, scope: dict) -> Optional[str]:
+        """
+        Returns the address of the client, like werkzeug ProxyFix behind the trusted proxies it is the address
+        that the outermost of them appended to X-Forwarded-For, the ones on its left could be forged by the client
+        """
+        if self._trusted_proxies > 0:
+            forwarded = [a.strip() for k, v in scope["headers"] if k == b"x-forwarded-for"
+                         for a in v.decode("latin-1").split(",")]
+
+            if len(forwarded) >= self._trusted_proxies:
+                return forwarded[-self._trusted_proxies]
+
+        return scope["client"][0] if scope.get("client") else None
+
+    @staticmethod
+    def _too_many_requests(e: RateLimitExceeded) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        return 429, [("content-type", "text/plain; charset=utf-8"), ("retry-after", str(math.ceil(e.retry_after)))], \
+               b"Too many requests in a short period"
+
+    @staticmethod
+    def _json(data) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        return 200, [("content-type", "application/json")], simplejson.dumps(data).encode()
+
+    @staticmethod
+    def _json_response(scope: dict, data) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Returns the data as json with an ETag, compressed with gzip if the client accepts it
+        The client gets a 304 if it has already the same data
+        """
+        body = simplejson.dumps(data).encode()
+
+        request_headers = {}
+        for k, v in scope["headers"]:
+            request_headers[k] = v.decode("latin-1")
+
+        encodings = [e.split(";")[0].strip() for e in request_headers.get(b"accept-encoding", "").split(",")]
+        compress = len(body) >= _GZIP_MIN_SIZE and "gzip" in encodings
+
+        # The compressed representation has its own tag
+        etag = "\"{}\"".format(hashlib.sha1(body).hexdigest() + ("-gzip" if compress else ""))
+
+        headers = [("etag", etag), ("cache-control", "no-cache"), ("vary", "Accept-Encoding")]
+
+        if etag in [t.strip().replace("W/", "", 1) for t in request_headers.get(b"if-none-match", "").split(",")]:
+            return 304, headers, b""
+
+        headers.append(("content-type", "application/json"))
+
+        if compress:
+            headers.append(("content-encoding", "gzip"))
+            body = gzip.compress(body, 6)
+
+        return 200, headers, body
+
+    @staticmethod
+    def _text(text: str, status: int = 200) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        return status, [("content-type", "text/html; charset=utf-8")], text.encode()
+
+    @staticmethod
+    async def _read_body(receive: Callable) -> bytes:
+        body = b""
+
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+
+            if not message.get("more_body", False):
+                return body
+
+    async def _not_found(self, scope: dict, receive: Callable):
+        return self._text("Not Found", 404)
+
+    async def _sync(self, scope: dict, receive: Callable):
+        # Tries to sync the url db
+        try:
+            await self._run(self._ss.sync)
+            return self._text("Done")
+
+        except RateLimitExceeded as e:
+            return self._too_many_requests(e)
+
+        except SyncInProgress:
+            return self._text("A sync is already in progress", 409)
+
+        except SyncFailed as e:
+            return self._text("An error has occurred ({})".format(e.__class__.__name__), 503)
+
+    async def _url_list(self, scope: dict, receive: Callable):
+        return self._json_response(scope, await self._run(self._ss.get_url_list))
+
+    async def _cache(self, scope: dict, receive: Callable):
+        return self._json(self._ss.get_cache_stats())
+
+    async def _healthz(self, scope: dict, receive: Callable):
+        return self._text("OK")
+
+    async def _readyz(self, scope: dict, receive: Callable):
+        status = await self._run(self._ss.get_status)
+
+        return 200 if status["ready"] else 503, [("content-type", "application/json")], \
+               simplejson.dumps(status).encode()
+
+    async def _get_metrics(self, scope: dict, receive: Callable):
+        if scope["method"] == "POST":
+            try:
+                data = simplejson.loads(await self._read_body(receive))
+
+            except ValueError:
+                data = None
+
+            if isinstance(data, dict) and "url" in data:
+                return await self._metrics_response(scope, data)
+
+        args = {k: v[0] for k, v in parse_qs(scope["query_string"].decode("latin-1")).items()}
+
+        if "url" in args:
+            return await self._metrics_response(scope, args)
+
+        return self._text("Forbidden", 403)
+
+    async def _get_bulk_metrics(self, scope: dict, receive: Callable):
+        data = None
+
+        if scope["method"] == "POST":
+            try:
+                data = simplejson.loads(await self._read_body(receive))
+
+            except ValueError:
+                data = None
+
+        if not isinstance(data, dict) or "url" not in data:
+            args = parse_qs(scope["query_string"].decode("latin-1"))
+            data = {k: v[0] for k, v in args.items()}
+
+            # The query string lists each url in its own url parameter
+            data["url"] = "all" if args.get("url") == ["all"] else args.get("url")
+
+        if not data["url"]:
+            return self._text("Forbidden", 403)
+
+        return await self._metrics_response(scope, data, self._ss.get_bulk_metrics)
+
+    async def _metrics_response(self, scope: dict, data: Mapping, get_metrics: Callable = None):
+        options = {k: data[k] for k in ("start", "end", "granularity") if k in data}
+
+        if "breakdown" in data:
+            options["breakdown"] = str(data["breakdown"]).lower() not in ("0", "false", "no")
+
+        try:
+            metrics = await self._run(functools.partial(get_metrics or self._ss.get_metrics, data["url"], **options))
+
+        except InvalidMetricsQuery as e:
+            return self._text(str(e), 400)
+
+        return self._json_response(scope, metrics)
+
+    async def _export(self, scope: dict, receive: Callable):
+        args = parse_qs(scope["query_string"].decode("latin-1"))
+
+        try:
+            chunks = self._ss.export_statistics(args["since"][0] if "since" in args else None)
+
+        except InvalidMetricsQuery as e:
+            return self._text(str(e), 400)
+
+        lines = ("".join(simplejson.dumps(r) + "\n" for r in records).encode() for records in chunks)
+
+        return 200, [("content-type", "application/x-ndjson")], self._stream(lines)
+
+    async def _metrics(self, scope: dict, receive: Callable):
+        return 200, [("content-type", CONTENT_TYPE)], exposition()
+
+    async def _redirect(self, scope: dict, receive: Callable):
+        with LATENCY.labels("redirect").time():
+            return await self._redirect_to_target(scope)
+
+    async def _redirect_to_target(self, scope: dict):
+        url = scope["path"][1:]
+
+        if not url or scope["method"] not in ("GET", "HEAD"):
+            return self._text("Not Found", 404)
+
+        try:
+            u = await self._ss.get_url_async(url)
+
+        except UrlNotFound:
+            return self._text("Not Found", 404)
+
+        self._ss.update_url_statistics(url, user_agent=self._header(scope, b"user-agent"), client=self._client(scope))
+
+        return 302, [("location", iri_to_uri(u)), ("content-type", "text/html; charset=utf-8")], b""
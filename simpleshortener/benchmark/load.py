@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Generates http load on the WebApp started against a local Redis stand-in
+
+The app is started with gunicorn through wsgi.gunicorn_entry, or with the dev server of __main__,
+then a mix of redirects, 404 probes, metrics polls and syncs is replayed by a few client processes.
+The shorts and the targets are drawn with a Zipf distribution, as the real traffic does.
+It reports the throughput and the p50/p95/p99 latency of each route.
+
+Run from the simpleshortener folder:
+    python -m benchmark.load --workers 4 --threads 2 --duration 30
+    python -m benchmark.load --mix redirect=50,metrics=50 --concurrency 16
+"""
+import argparse
+import bisect
+import http.client
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+
+from .standin import RedisStandIn, free_port
+from .suite import write_url_file
+
+# Default share of each route of the replayed traffic
+_MIX = "redirect=90,not_found=5,metrics=4,sync=1"
+
+_ROUTES = ["redirect", "not_found", "metrics", "sync"]
+
+
+class _Zipf:
+    """Draws the items of a list, the k-th one with a probability proportional to 1/k^s"""
+
+    def __init__(self, items: list, s: float, rnd: random.Random):
+        self._items = items
+        self._rnd = rnd
+        self._cumulative = list(itertools.accumulate(1 / (k ** s) for k in range(1, len(items) + 1)))
+
+    def __call__(self):
+        return self._items[bisect.bisect_left(self._cumulative, self._rnd.random() * self._cumulative[-1])]
+
+
+def _start_server(args: argparse.Namespace, env: dict, port: int) -> subprocess.Popen:
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                   "-b", "127.0.0.1:{}".format(port),
+                   "-w", str(args.workers),
+                   "--threads", str(args.threads),
+                   "wsgi:gunicorn_entry()"]
+    else:
+        command = [sys.executable, "__main__.py",
+                   "-n", "127.0.0.1", "-p", str(port),
+                   "-u", env["SS_REDIS_URL"], "-s", env["SS_REDIS_STATISTICS"], "-f", env["SS_URL_FILE"]]
+
+    process = subprocess.Popen(command, cwd=cwd, env=dict(os.environ, **env),
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+
+    # Waits for the app to be ready, the first sync runs in background
+    for _ in range(600):
+        if process.poll() is not None:
+            raise RuntimeError("The app exited with code {}".format(process.returncode))
+
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/readyz")
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+
+            if response.status == 200:
+                return process
+
+        except OSError:
+            pass
+
+        time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("The app didn't start")
+
+
+def _client(job: dict) -> Dict[str, List[Tuple[float, float, int]]]:
+    """
+    Replays the traffic with some threads until the deadline
+
+    :return: the start, the latency and the status of each request for each route
+    :rtype: Dict[str, List[Tuple[float, float, int]]]
+    """
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def worker(seed: int):
+        rnd = random.Random(seed)
+        short = _Zipf(job["shorts"], job["zipf"], rnd)
+        target = _Zipf(job["targets"], job["zipf"], rnd)
+        routes, weights = zip(*job["mix"].items())
+
+        connection = http.client.HTTPConnection("127.0.0.1", job["port"], timeout=30)
+        local = defaultdict(list)
+
+        while True:
+            start = time.time()
+            if start >= job["deadline"]:
+                break
+
+            route = rnd.choices(routes, weights)[0]
+
+            if route == "redirect":
+                path = "/" + quote(short())
+            elif route == "not_found":
+                path = "/missing-{}".format(rnd.randrange(1 << 30))
+            elif route == "metrics":
+                path = "/api/v2/metrics?url=" + quote(target(), safe="")
+            else:
+                path = "/api/v2/sync"
+
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = 0
+
+            local[route].append((start, time.time() - start, status))
+
+        connection.close()
+
+        with lock:
+            for route, values in local.items():
+                samples[route].extend(values)
+
+    threads = [threading.Thread(target=worker, args=(job["seed"] * 1000 + i,)) for i in range(job["concurrency"])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return dict(samples)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    return values[max(math.ceil(p * len(values)) - 1, 0)]
+
+
+def report(samples: Dict[str, List[Tuple[float, float, int]]], start: float, duration: float) -> dict:
+    """
+    Computes throughput, latency percentiles and statuses of each route
+
+    :param samples: the start, the latency and the status of each request for each route
+    :type samples: Dict[str, List[Tuple[float, float, int]]]
+    :param start: when the measured window starts, the previous requests are the warmup
+    :type start: float
+    :param duration: the length of the measured window in seconds
+    :type duration: float
+    :return: the results of each route
+    :rtype: dict
+    """
+    results = {}
+
+    for route in _ROUTES + ["all"]:
+        if route == "all":
+            values = [v for r in samples.values() for v in r if v[0] >= start]
+        else:
+            values = [v for v in samples.get(route, []) if v[0] >= start]
+
+        if not values:
+            continue
+
+        latencies = sorted(v[1] for v in values)
+
+        results[route] = {
+            "requests": len(values),
+            "throughput": len(values) / duration,
+            "p50": _percentile(latencies, 0.50) * 1000,
+            "p95": _percentile(latencies, 0.95) * 1000,
+            "p99": _percentile(latencies, 0.99) * 1000,
+            "status": dict(Counter(str(v[2]) for v in values))
+        }
+
+    return results
+
+
+def run(args: argparse.Namespace) -> dict:
+    with RedisStandIn(args.redis_server) as standin, tempfile.TemporaryDirectory() as folder:
+        url_file = os.path.join(folder, "url.json")
+        write_url_file(url_file, args.entries)
+
+        with open(url_file) as f:
+            entries = json.load(f)
+
+        env = {
+            "SS_URL_FILE": url_file,
+            "SS_REDIS_URL": standin.url(0),
+            "SS_REDIS_STATISTICS": standin.url(1),
+            "PROMETHEUS_MULTIPROC_DIR": os.path.join(folder, "prometheus")
+        }
+        os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+
+        port = free_port()
+        server = _start_server(args, env, port)
+
+        print("Redis stand-in: {}, app: {} on port {}".format(standin.kind, args.server, port), file=sys.stderr)
+
+        try:
+            start = time.time() + args.warmup
+            jobs = [{
+                "port": port,
+                "seed": i,
+                "concurrency": args.concurrency,
+                "deadline": start + args.duration,
+                "zipf": args.zipf,
+                "mix": args.mix,
+                "shorts": [s for e in entries for s in e["short"]],
+                "targets": [e["target"] for e in entries]
+            } for i in range(args.clients)]
+
+            with multiprocessing.Pool(args.clients) as pool:
+                samples = defaultdict(list)
+                for result in pool.map(_client, jobs):
+                    for route, values in result.items():
+                        samples[route].extend(values)
+
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "redis": standin.kind,
+            "server": args.server,
+            "workers": args.workers,
+            "threads": args.threads,
+            "clients": args.clients,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "zipf": args.zipf
+        },
+        "results": report(samples, start, args.duration)
+    }
+
+
+def _mix(value: str) -> Dict[str, float]:
+    mix = {}
+
+    for item in value.split(","):
+        route, weight = item.split("=")
+
+        if route not in _ROUTES:
+            raise argparse.ArgumentTypeError("unknown route {}, use one of {}".format(route, ", ".join(_ROUTES)))
+
+        mix[route] = float(weight)
+
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-server", dest="redis_server", default=None,
+                        help="path of redis-server or \"fakeredis\", by default redis-server if it is in the PATH")
+    parser.add_argument("--server", dest="server", choices=["gunicorn", "dev"], default="gunicorn",
+                        help="starts the app with gunicorn or with the dev server")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=2, help="number of gunicorn workers")
+    parser.add_argument("--threads", dest="threads", type=int, default=1, help="number of threads of each worker")
+    parser.add_argument("--entries", dest="entries", type=int, default=10000, help="number of shorts in the url db")
+    parser.add_argument("--mix", dest="mix", type=_mix, default=_mix(_MIX),
+                        help="share of each route, default \"{}\"".format(_MIX))
+    parser.add_argument("--zipf", dest="zipf", type=float, default=1.1,
+                        help="exponent of the Zipf distribution of the shorts and the targets")
+    parser.add_argument("-c", "--concurrency", dest="concurrency", type=int, default=8,
+                        help="number of connections of each client process")
+    parser.add_argument("--clients", dest="clients", type=int, default=2, help="number of client processes")
+    parser.add_argument("-t", "--duration", dest="duration", type=float, default=30,
+                        help="seconds of measured load")
+    parser.add_argument("--warmup", dest="warmup", type=float, default=3,
+                        help="seconds of load before the measure starts")
+    parser.add_argument("-o", "--output", dest="output", default=None, help="file to save the results")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="shows the log of the app")
+    args = parser.parse_args()
+
+    current = run(args)
+
+    print("{:<12}{:>10}{:>12}{:>10}{:>10}{:>10}  {}".format("route", "requests", "req/s", "p50 ms", "p95 ms",
+                                                             "p99 ms", "status"))
+    for route, result in current["results"].items():
+        print("{:<12}{:>10}{:>12,.1f}{:>10.2f}{:>10.2f}{:>10.2f}  {}".format(
+            route, result["requests"], result["throughput"], result["p50"], result["p95"], result["p99"],
+            " ".join("{}x{}".format(k, v) for k, v in sorted(result["status"].items()))))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Local Redis stand-in for the benchmarks
+
+A redis-server found in the PATH is spawned on a free port, otherwise a fakeredis tcp server
+is spawned in a child process, so the measured process only contains the client side.
+
+Run from the simpleshortener folder to serve fakeredis alone: python -m benchmark.standin --port 6390
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+from redis import StrictRedis
+from redis.exceptions import ConnectionError, ResponseError
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RedisStandIn:
+    """
+    Spawns a local redis and stops it on exit
+
+    :param server: the path of redis-server, "fakeredis" to force the fakeredis server,
+        None to use redis-server if it is in the PATH
+    :type server: Optional[str]
+    """
+
+    def __init__(self, server: Optional[str] = None):
+        if server is None:
+            server = shutil.which("redis-server") or "fakeredis"
+
+        self.kind = "fakeredis" if server == "fakeredis" else "redis-server"
+        self.port = free_port()
+
+        if self.kind == "fakeredis":
+            self._args = [sys.executable, "-m", "benchmark.standin", "--port", str(self.port)]
+        else:
+            self._args = [server, "--port", str(self.port), "--save", "", "--appendonly", "no"]
+
+        self._process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "RedisStandIn":
+        self._process = subprocess.Popen(self._args, stdout=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        # Waits for the server to accept connections
+        redis = StrictRedis(port=self.port)
+        for _ in range(100):
+            try:
+                redis.ping()
+                break
+
+            except ConnectionError:
+                if self._process.poll() is not None:
+                    raise RuntimeError("The redis stand-in exited with code {}".format(self._process.returncode))
+
+                time.sleep(0.1)
+
+        else:
+            self.__exit__()
+            raise RuntimeError("The redis stand-in didn't start")
+
+        redis.close()
+
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def url(self, db: int = 0) -> str:
+        """
+        Returns the url of a db of the stand-in
+
+        :param db: the number of the db
+        :type db: int
+        :return: the redis url
+        :rtype: str
+        """
+        return "redis://127.0.0.1:{}/{}".format(self.port, db)
+
+    def flush(self) -> None:
+        """
+        Drops every db of the stand-in
+        """
+        redis = StrictRedis(port=self.port)
+        redis.flushall()
+        redis.close()
+
+    def memory(self) -> Optional[int]:
+        """
+        Returns the memory used by the stand-in in bytes
+
+        It is the used_memory of redis-server or the resident memory of the fakeredis process
+
+        :return: the bytes or None if it can't be measured on this platform
+        :rtype: Optional[int]
+        """
+        try:
+            redis = StrictRedis(port=self.port)
+            try:
+                return int(redis.info("memory")["used_memory"])
+            finally:
+                redis.close()
+
+        except ResponseError:
+            pass
+
+        try:
+            with open("/proc/{}/status".format(self._process.pid)) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+
+        except OSError:
+            pass
+
+        return None
+
+
+if __name__ == "__main__":
+    import threading
+
+    from fakeredis import TcpFakeServer
+    from fakeredis._clients._tcp_server import TCPFakeRequestHandler
+
+    class _RequestHandler(TCPFakeRequestHandler):
+        """Replies with the errors of the commands instead of closing the connection, as redis does"""
+
+        def setup(self) -> None:
+            super(_RequestHandler, self).setup()
+
+            read_response = self.current_client.read_response
+
+            def read(*args, **kwargs):
+                try:
+                    return read_response(*args, **kwargs)
+
+                except ResponseError as e:
+                    return e
+
+            self.current_client.read_response = read
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", dest="port", type=int, default=6379, help="port to listen on")
+    args = parser.parse_args()
+
+    server = TcpFakeServer(("127.0.0.1", args.port), server_type="redis")
+    server.RequestHandlerClass = _RequestHandler
+    server.daemon_threads = True
+
+    # Serves in a daemon thread so a SIGTERM stops the process at once
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        threading.Event().wait()
+
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the hot paths of SimpleShortener against a local Redis stand-in
+
+It measures the throughput of get_url on hit and miss, the cost of update_url_statistics,
+the time and memory of a sync of url files of growing size and the latency of get_metrics
+as the number of shorts and of days grows, and of get_bulk_metrics on every target,
+and the redis memory of the statistics before and after the compaction.
+The results can be saved as a baseline and compared with a later run to catch the regressions.
+
+Run from the simpleshortener folder:
+    python -m benchmark.suite --output baseline.json
+    python -m benchmark.suite --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, timedelta
+from itertools import chain
+from typing import Callable, Dict, List
+
+from simpleshortener import SimpleShortener, UrlNotFound
+from simpleshortener.redis_key import STATISTICS_FIELD_BROWSER, STATISTICS_FIELD_TOTAL, STATISTICS_FIELD_USERAGENT
+from .standin import RedisStandIn
+from .useragent import USER_AGENTS
+
+# Number of shorts of each target of the generated url files
+_SHORTS_PER_TARGET = 4
+
+# Fraction of the entries changed between two syncs
+_SYNC_CHANGES = 0.01
+
+
+def write_url_file(path: str, entries: int, version: int = 0, extra: List[dict] = ()) -> None:
+    """Writes a url file with the given number of shorts, the version changes a fraction of the targets"""
+    changed = max(int(entries * _SYNC_CHANGES), 1) if version else 0
+
+    generated = ({"target": "https://example.com/{}/{}".format(i, version if i < changed else 0),
+                  "short": ["s{}".format(j) for j in range(i, min(i + _SHORTS_PER_TARGET, entries))]}
+                 for i in range(0, entries, _SHORTS_PER_TARGET))
+
+    with open(path, "w") as f:
+        f.write("[")
+
+        for i, entry in enumerate(chain(generated, extra)):
+            if i:
+                f.write(",")
+            json.dump(entry, f)
+
+        f.write("]")
+
+
+def _rate(func: Callable, args: list, repeat: int = 3) -> float:
+    """Returns the best rate of calls per second over a few runs"""
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for a in args:
+            func(a)
+        seconds = time.perf_counter() - start
+
+        best = seconds if best is None else min(best, seconds)
+
+    return len(args) / best
+
+
+def _result(value: float, unit: str, better: str) -> dict:
+    return {"value": value, "unit": unit, "better": better}
+
+
+def bench_get_url(cached: SimpleShortener, uncached: SimpleShortener, entries: int, n: int) -> Dict[str, dict]:
+    rnd = random.Random(0)
+    hits = ["s{}".format(rnd.randrange(entries)) for _ in range(n)]
+    misses = ["missing{}".format(i) for i in range(n)]
+
+    def miss(ss: SimpleShortener) -> Callable:
+        def func(short: str):
+            try:
+                ss.get_url(short)
+            except UrlNotFound:
+                pass
+
+        return func
+
+    # Warms the cache so the hits are served by the process
+    for short in set(hits):
+        cached.get_url(short)
+
+    return {
+        "get_url.hit.cached": _result(_rate(cached.get_url, hits), "ops/s", "higher"),
+        "get_url.hit.redis": _result(_rate(uncached.get_url, hits), "ops/s", "higher"),
+        "get_url.miss": _result(_rate(miss(uncached), misses), "ops/s", "higher")
+    }
+
+
+def bench_statistics(ss: SimpleShortener, entries: int, n: int) -> Dict[str, dict]:
+    rnd = random.Random(0)
+    shorts = ["s{}".format(rnd.randrange(entries)) for _ in range(n)]
+    user_agents = [rnd.choice(USER_AGENTS) for _ in range(n)]
+    clients = ["10.0.{}.{}".format(rnd.randrange(256), rnd.randrange(256)) for _ in range(n)]
+    today = date.today().strftime("%Y-%m-%d")
+
+    # Cost paid by the request
+    start = time.perf_counter()
+    for short, user_agent, client in zip(shorts, user_agents, clients):
+        ss.update_url_statistics(short, user_agent=user_agent, client=client)
+    record = n / (time.perf_counter() - start)
+
+    # Cost paid by the background writer for a batch
+    events = Counter(zip(shorts, [today] * n, user_agents, clients))
+    start = time.perf_counter()
+    ss._write_statistics(events)
+    write = n / (time.perf_counter() - start)
+
+    return {
+        "update_url_statistics.record": _result(record, "ops/s", "higher"),
+        "update_url_statistics.write": _result(write, "events/s", "higher")
+    }
+
+
+def bench_metrics(ss: SimpleShortener, grid: List[tuple], repeat: int) -> Dict[str, dict]:
+    rnd = random.Random(0)
+    results = {}
+
+    for shorts, days in grid:
+        target = "https://metrics.example.com/{}/{}".format(shorts, days)
+
+        # Fills the statistics of each short for each day
+        counters = Counter()
+        for s in range(shorts):
+            short = "m{}x{}x{}".format(shorts, days, s)
+            for d in range(days):
+                d = (date.today() - timedelta(days=d)).strftime("%Y-%m-%d")
+                counters[(short, STATISTICS_FIELD_TOTAL.format(date=d))] += 10
+                for _ in range(3):
+                    counters[(short, STATISTICS_FIELD_USERAGENT.format(
+                        date=d, user_agent=rnd.choice(["windows", "android", "ios", "mac"])))] += 1
+                    counters[(short, STATISTICS_FIELD_BROWSER.format(
+                        date=d, browser=rnd.choice(["chrome", "firefox", "safari"])))] += 1
+
+        ss._statistics_store.write(counters, {short: target for short, _ in counters})
+
+        results["get_metrics.{}shorts.{}days".format(shorts, days)] = _result(
+            1000 / _rate(ss.get_metrics, [target] * repeat), "ms", "lower")
+
+    # The overview of every target in a single call
+    results["get_bulk_metrics.all"] = _result(1000 / _rate(ss.get_bulk_metrics, ["all"] * repeat), "ms", "lower")
+
+    return results
+
+
+def bench_compaction(ss: SimpleShortener, standin: RedisStandIn, shorts: int, days: int) -> Dict[str, dict]:
+    rnd = random.Random(0)
+    standin.flush()
+
+    # Fills the statistics of closed days, the compaction packs them all
+    counters = Counter()
+    for s in range(shorts):
+        for d in range(2, days + 2):
+            d = (date.today() - timedelta(days=d)).strftime("%Y-%m-%d")
+            counters[("c{}".format(s), STATISTICS_FIELD_TOTAL.format(date=d))] += 10
+            for user_agent in ["windows", "android", "ios", "mac"]:
+                counters[("c{}".format(s), STATISTICS_FIELD_USERAGENT.format(date=d, user_agent=user_agent))] += \
+                    rnd.randrange(1, 5)
+            for browser in ["chrome", "firefox", "safari"]:
+                counters[("c{}".format(s), STATISTICS_FIELD_BROWSER.format(date=d, browser=browser))] += \
+                    rnd.randrange(1, 5)
+
+    ss._statistics_store.write(counters, {})
+
+    results = {}
+    name = "compaction.{}shorts.{}days".format(shorts, days)
+
+    memory = standin.memory()
+    if memory is not None:
+        results[name + ".redis_memory.live"] = _result(memory / 2 ** 20, "MiB", "lower")
+
+    start = time.perf_counter()
+    ss._statistics_store.compact(date.today().strftime("%Y-%m-%d"),
+                                 (date.today() - timedelta(days=days + 2)).strftime("%Y-%m-%d"))
+    results[name + ".time"] = _result(time.perf_counter() - start, "s", "lower")
+
+    memory = standin.memory()
+    if memory is not None:
+        results[name + ".redis_memory.packed"] = _result(memory / 2 ** 20, "MiB", "lower")
+
+    return results
+
+
+def metrics_entries(grid: List[tuple]) -> List[dict]:
+    """Returns the url file entries of the targets used by bench_metrics"""
+    return [{"target": "https://metrics.example.com/{}/{}".format(shorts, days),
+             "short": ["m{}x{}x{}".format(shorts, days, s) for s in range(shorts)]}
+            for shorts, days in grid]
+
+
+def bench_sync(ss: SimpleShortener, standin: RedisStandIn, url_file: str, sizes: List[int]) -> Dict[str, dict]:
+    results = {}
+
+    for size in sizes:
+        standin.flush()
+
+        # The sync body is called directly, the rate limit would only slow the runs down,
+        # it holds the lock for the whole size as the sync extends and checks it
+        ss._sync_lock.acquire()
+
+        write_url_file(url_file, size)
+        start = time.perf_counter()
+        ss._sync()
+        results["sync.{}.cold".format(size)] = _result(time.perf_counter() - start, "s", "lower")
+
+        write_url_file(url_file, size, version=1)
+        start = time.perf_counter()
+        ss._sync()
+        results["sync.{}.update".format(size)] = _result(time.perf_counter() - start, "s", "lower")
+
+        # Memory is measured in a separate run since tracemalloc slows down the allocations
+        write_url_file(url_file, size, version=2)
+        tracemalloc.start()
+        ss._sync()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results["sync.{}.peak_memory".format(size)] = _result(peak / 2 ** 20, "MiB", "lower")
+
+        ss._sync_lock.release()
+
+        memory = standin.memory()
+        if memory is not None:
+            results["sync.{}.redis_memory".format(size)] = _result(memory / 2 ** 20, "MiB", "lower")
+
+    return results
+
+
+def run(args: argparse.Namespace) -> dict:
+    grid = [(shorts, days) for shorts in args.metrics_shorts for days in args.metrics_days]
+
+    results = {}
+
+    with RedisStandIn(args.redis_server) as standin, tempfile.TemporaryDirectory() as folder:
+        url_file = os.path.join(folder, "url.json")
+        write_url_file(url_file, args.entries, extra=metrics_entries(grid))
+
+        options = {
+            "url_file": url_file,
+            "redis_url": standin.url(0),
+            "redis_statistics": standin.url(1),
+            "statistics_queue_size": args.n * 2
+        }
+
+        # The first instance syncs the db, the second one runs without the caches
+        cached = SimpleShortener(**options)
+        uncached = SimpleShortener(url_cache_size=0, metrics_cache_ttl=0, **options)
+
+        # Waits for the first sync, it runs in background
+        cached._startup.join()
+        uncached._startup.join()
+
+        print("Redis stand-in: {}".format(standin.kind), file=sys.stderr)
+
+        for name, bench in [("get_url", lambda: bench_get_url(cached, uncached, args.entries, args.n)),
+                            ("statistics", lambda: bench_statistics(uncached, args.entries, args.n)),
+                            ("metrics", lambda: bench_metrics(uncached, grid, args.metrics_repeat)),
+                            ("sync", lambda: bench_sync(uncached, standin, url_file, args.sync_sizes)),
+                            ("compaction", lambda: bench_compaction(uncached, standin, args.compaction_shorts,
+                                                                    args.compaction_days))]:
+            print("Running {}...".format(name), file=sys.stderr)
+            results.update(bench())
+
+        cached.close()
+        uncached.close()
+
+    return {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "redis": standin.kind
+        },
+        "results": results
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compares the results with a baseline
+
+    :param current: the results of this run
+    :type current: dict
+    :param baseline: the results of a previous run
+    :type baseline: dict
+    :param tolerance: the relative change allowed before a result is a regression
+    :type tolerance: float
+    :return: the description of each regression
+    :rtype: List[str]
+    """
+    regressions = []
+
+    if current["meta"]["redis"] != baseline["meta"]["redis"]:
+        print("Warning: the baseline was run against {}".format(baseline["meta"]["redis"]), file=sys.stderr)
+
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        old, new = baseline["results"][name]["value"], result["value"]
+        change = (new - old) / old if old else 0.0
+
+        if (result["better"] == "higher" and change < -tolerance) or \
+                (result["better"] == "lower" and change > tolerance):
+            regressions.append("{}: {:.4g} -> {:.4g} {} ({:+.1%})".format(name, old, new, result["unit"], change))
+
+    return regressions
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-server", dest="redis_server", default=None,
+                        help="path of redis-server or \"fakeredis\", by default redis-server if it is in the PATH")
+    parser.add_argument("-n", dest="n", type=int, default=20000, help="number of calls of each throughput benchmark")
+    parser.add_argument("--entries", dest="entries", type=int, default=10000,
+                        help="number of shorts in the url db of the lookup benchmarks")
+    parser.add_argument("--sync-sizes", dest="sync_sizes", type=_ints, default=[1000, 100000, 1000000],
+                        help="comma separated sizes of the synced url files")
+    parser.add_argument("--metrics-shorts", dest="metrics_shorts", type=_ints, default=[1, 10, 100],
+                        help="comma separated numbers of shorts of the target of get_metrics")
+    parser.add_argument("--metrics-days", dest="metrics_days", type=_ints, default=[1, 7, 21],
+                        help="comma separated numbers of days of statistics of get_metrics")
+    parser.add_argument("--metrics-repeat", dest="metrics_repeat", type=int, default=50,
+                        help="number of calls of each get_metrics benchmark")
+    parser.add_argument("--compaction-shorts", dest="compaction_shorts", type=int, default=10000,
+                        help="number of shorts of the compaction benchmark")
+    parser.add_argument("--compaction-days", dest="compaction_days", type=int, default=14,
+                        help="number of days of statistics of each short of the compaction benchmark")
+    parser.add_argument("-o", "--output", dest="output", default=None, help="file to save the results as baseline")
+    parser.add_argument("-b", "--baseline", dest="baseline", default=None, help="baseline to compare the results with")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.2,
+                        help="relative change allowed before a result is a regression")
+    args = parser.parse_args()
+
+    current = run(args)
+
+    for name, result in current["results"].items():
+        print("{:<56}{:>14,.3f} {}".format(name, result["value"], result["unit"]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.tolerance)
+
+        for regression in regressions:
+            print("Regression: {}".format(regression), file=sys.stderr)
+
+        sys.exit(1 if regressions else 0)
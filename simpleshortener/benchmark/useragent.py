@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Compares the throughput of UserAgentClassifier with the chain of if/elif it replaced
+
+Run from the simpleshortener folder: python -m benchmark.useragent
+"""
+import argparse
+import random
+import timeit
+
+from useragent import UserAgentClassifier
+
+# A sample of real user agents, the traffic repeats a few of them
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 "
+    "Safari/537.36 Edg/118.0.2088.46",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/119.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 "
+    "Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 "
+    "Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 13; SM-S908B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/22.0 "
+    "Chrome/111.0.5563.116 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+    "TelegramBot (like TwitterBot)",
+    "WhatsApp/2.23.20.0",
+    "curl/8.4.0"
+]
+
+
+def legacy(user_agent: str) -> str:
+    if "Windows" in user_agent:
+        return "windows"
+    elif "Macintosh" in user_agent:
+        return "mac"
+    elif "iPhone" in user_agent:
+        return "ios"
+    elif "Android" in user_agent:
+        return "android"
+    elif "Linux" in user_agent:
+        return "linux"
+    else:
+        return "other"
+
+
+def run(n: int, distinct: int) -> dict:
+    """
+    Classifies n user agents drawn from the sample, each made unique in distinct variants
+
+    :return: the classifications per second of each implementation
+    :rtype: dict
+    """
+    rnd = random.Random(0)
+    pool = ["{} {}".format(ua, i) for ua in USER_AGENTS for i in range(distinct)]
+    traffic = [rnd.choice(pool) for _ in range(n)]
+
+    classifier = UserAgentClassifier()
+    uncached = UserAgentClassifier(cache_size=0)
+
+    results = {}
+
+    for name, func in [("if/elif chain", legacy),
+                       ("classifier (cached)", classifier.classify),
+                       ("classifier (uncached)", uncached.classify)]:
+        seconds = min(timeit.repeat(lambda: [func(ua) for ua in traffic], number=1, repeat=3))
+        results[name] = n / seconds
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="n", type=int, default=200000, help="number of user agents to classify")
+    parser.add_argument("-d", "--distinct", dest="distinct", type=int, default=10,
+                        help="number of variants of each sample user agent")
+    args = parser.parse_args()
+
+    for name, rate in run(args.n, args.distinct).items():
+        print("{:<24}{:>14,.0f} ua/s".format(name, rate))
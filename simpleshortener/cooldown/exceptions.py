@@ -1,2 +0,0 @@
-class CooldownError(Exception):
-    pass
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Exports the statistics as newline delimited json, a line for each counter of each day of each short
+
+The statistics db is walked with SCAN and read in chunks, so it can run on a live db of any size.
+The options default to the envs of the service.
+
+Run from the simpleshortener folder:
+    python export.py --since 2021-03-01 -o statistics.ndjson
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+from typing import List, Optional
+
+import simplejson as simplejson
+from redis import StrictRedis
+
+from simpleshortener.redis_key import URL_GENERATION, URL_TABLE
+from simpleshortener.statistics import StatisticsStore
+
+if __name__ == "__main__":
+
+    # Gets inline arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-u", "--redis-url", dest="redis_url",
+                        default=os.getenv("SS_REDIS_URL", "redis://127.0.0.1:6379/0"),
+                        help="redis url for \"url\" in \"redis://{host}[:port]/{db}\" format")
+    parser.add_argument("-s", "--redis-statistics", dest="redis_statistics",
+                        default=os.getenv("SS_REDIS_STATISTICS", "redis://127.0.0.1:6379/1"),
+                        help="redis url for \"statistics\" in \"redis://{host}[:port]/{db}\" format, "
+                             "comma separated urls for sharded statistics")
+    parser.add_argument("-e", "--statistics-expiration", dest="statistics_expiration", type=int,
+                        default=int(os.getenv("SS_STATISTICS_EXPIRATION", 21)),
+                        help="expiration of the statistics in days, the older ones are not exported")
+    parser.add_argument("--since", dest="since", type=date.fromisoformat, default=None,
+                        help="first date to export in \"YYYY-MM-DD\" format, e.g. the day after the last export")
+    parser.add_argument("-o", "--output", dest="output", default=None, help="file to write, stdout by default")
+
+    # Parses args
+    args = parser.parse_args()
+
+    redis_url = StrictRedis.from_url(args.redis_url, encoding="utf-8", decode_responses=True)
+
+    urls = [u.strip() for u in args.redis_statistics.split(",") if u.strip()]
+    store = StatisticsStore([StrictRedis.from_url(u, encoding="utf-8", decode_responses=True) for u in urls],
+                            timedelta(days=args.statistics_expiration), names=urls)
+
+    def lookup(shorts: List[str]) -> List[Optional[str]]:
+        # Reads the targets from the url table of the current generation
+        generation = int(redis_url.get(URL_GENERATION) or 0)
+        return redis_url.hmget(URL_TABLE.format(generation % 2), shorts)
+
+    start = date.today() - timedelta(days=args.statistics_expiration)
+    if args.since is not None:
+        start = max(start, args.since)
+
+    output = open(args.output, "w") if args.output is not None else sys.stdout
+
+    try:
+        for records in store.export(start.strftime("%Y-%m-%d"), lookup):
+            output.write("".join(simplejson.dumps(r) + "\n" for r in records))
+
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+        store.close()
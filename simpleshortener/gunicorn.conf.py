@@ -0,0 +1,20 @@
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+# Folder where each worker writes its metrics, they are aggregated by the /metrics endpoint
+_multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    # Removes the metrics of the previous run
+    if _multiproc_dir is not None:
+        shutil.rmtree(_multiproc_dir, ignore_errors=True)
+        os.makedirs(_multiproc_dir)
+
+
+def child_exit(server, worker):
+    # Drops the gauges of the dead worker
+    if _multiproc_dir is not None:
+        multiprocess.mark_process_dead(worker.pid)
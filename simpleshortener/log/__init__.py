@@ -1,7 +1,17 @@
-__all__ = ["LoggerSetup"]
+__all__ = ["LoggerSetup", "AccessLog"]
 
+import atexit
 import logging
-from typing import Union, List
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Union, List, Optional
+
+import simplejson as simplejson
+
+from telemetry import LOG_DROPPED
+from useragent import UserAgentClassifier
 
 VERBOSITY_LEVELS = {
     "CRITICAL": logging.CRITICAL,
@@ -11,16 +21,173 @@ VERBOSITY_LEVELS = {
     "DEBUG": logging.DEBUG
 }
 
+# Format of the log lines
+_FORMAT = "%(levelname)s|%(name)s|%(message)s"
+
+# Max number of records waiting to be written, the new ones are dropped while it is full
+_QUEUE_SIZE = 10000
+
+# Writer of the records of the process, started by the first LoggerSetup
+_listener: Optional[QueueListener] = None
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    Hands the records to the writer thread as they are, the queue doesn't leave the process
+    so the message is formatted with its arguments only by the writer
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # A slow stderr never blocks the caller
+        try:
+            self.queue.put_nowait(record)
+
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Waits for room, the queue can be full at shutdown
+        self.queue.put(self._sentinel)
+
+
+def _start_listener() -> None:
+    """
+    Routes the records of the root logger through a queue to a thread that writes them on stderr
+    It does nothing if the root logger has already a handler, like logging.basicConfig
+    """
+    global _listener
+
+    root = logging.getLogger()
+
+    if _listener is not None or root.handlers:
+        return
+
+    records = queue.Queue(_QUEUE_SIZE)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(_FORMAT))
+
+    _listener = _Listener(records, handler)
+    _listener.start()
+
+    root.addHandler(_LazyQueueHandler(records))
+
+    # Writes the pending records on shutdown, after the handlers registered later
+    atexit.register(_listener.stop)
+
+
 class LoggerSetup:
-    def __init__(self,loggers: List[str], log_level: Union[int, str], log_level_modules: Union[int, str] = logging.ERROR):
+    def __init__(self, loggers: List[str], log_level: Union[int, str], log_level_modules: Union[int, str] = logging.ERROR):
         if isinstance(log_level, str):
             log_level = VERBOSITY_LEVELS[log_level]
 
         if isinstance(log_level_modules, str):
-            modules_log_level = VERBOSITY_LEVELS[log_level_modules]
+            log_level_modules = VERBOSITY_LEVELS[log_level_modules]
+
+        # The callers only enqueue the records, they are formatted and written by a background thread
+        _start_listener()
 
-        # Set format for the log
-        logging.basicConfig(format="%(levelname)s|%(name)s|%(message)s", level=log_level_modules)
+        # The level of the root logger applies to the external modules
+        logging.getLogger().setLevel(log_level_modules)
 
         for l in loggers:
             logging.getLogger(l).setLevel(log_level)
+
+
+class _AccessRecord:
+    """
+    Fields of a request encoded as json only when the record is written
+    """
+    __slots__ = ("classifier", "time", "endpoint", "short", "status", "latency", "user_agent", "sample_rate")
+
+    def __init__(self, classifier: UserAgentClassifier, endpoint: Optional[str], short: Optional[str], status: int,
+                 latency: float, user_agent: Optional[str], sample_rate: float):
+        self.classifier = classifier
+        self.time = time.time()
+        self.endpoint = endpoint
+        self.short = short
+        self.status = status
+        self.latency = latency
+        self.user_agent = user_agent
+        self.sample_rate = sample_rate
+
+    def __str__(self) -> str:
+        user_agent = self.classifier.classify(self.user_agent)
+
+        return simplejson.dumps({
+            "time": round(self.time, 3),
+            "endpoint": self.endpoint,
+            "short": self.short,
+            "status": self.status,
+            "latency_ms": round(self.latency * 1000, 3),
+            "os": user_agent.os,
+            "browser": user_agent.browser,
+            "sample_rate": self.sample_rate
+        })
+
+
+class AccessLog:
+    """
+    Structured access log, a json line for a random sample of the requests
+
+    The request only draws the sample and enqueues the record: the user agent is classified
+    and the line is encoded by the writer thread of LoggerSetup. Each line carries the sample rate,
+    so the counts can be scaled back to the traffic.
+    """
+
+    def __init__(self,
+                 sample_rate: float = 0.0,
+                 name: str = "access",
+                 classifier: Optional[UserAgentClassifier] = None):
+        """
+        :param sample_rate: the fraction of the requests logged, 0 disables the log and 1 logs all of them
+        :type sample_rate: float
+        :param name: the name of the logger, its level is INFO
+        :type name: str
+        :param classifier: the classifier of the user agents in the os and browser buckets
+        :type classifier: Optional[UserAgentClassifier]
+        """
+        self._sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self._classifier = classifier or UserAgentClassifier()
+
+        self._logger = logging.getLogger(name)
+        self._logger.setLevel(logging.INFO)
+
+    def sampled(self) -> bool:
+        """
+        Draws if the current request is logged
+
+        :return: True if the request has to be logged
+        :rtype: bool
+        """
+        return self._sample_rate >= 1.0 or (self._sample_rate > 0.0 and random.random() < self._sample_rate)
+
+    def log(self, endpoint: Optional[str], status: int, latency: float, short: Optional[str] = None,
+            user_agent: Optional[str] = None) -> None:
+        """
+        Logs a request, the caller checks sampled first
+
+        :param endpoint: the endpoint of the request
+        :type endpoint: Optional[str]
+        :param status: the status of the response
+        :type status: int
+        :param latency: the seconds spent on the request
+        :type latency: float
+        :param short: the short of a redirect
+        :type short: Optional[str]
+        :param user_agent: the user agent string of the client
+        :type user_agent: Optional[str]
+        """
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+
+        record = _AccessRecord(self._classifier, endpoint, short, status, latency, user_agent, self._sample_rate)
+
+        # Skips the lookup of the caller in the stack done by Logger.info, the access lines don't show it
+        self._logger.handle(self._logger.makeRecord(self._logger.name, logging.INFO, __file__, 0, "%s", (record,),
+                                                    None))
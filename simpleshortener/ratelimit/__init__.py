@@ -0,0 +1,203 @@
+__all__ = ["RateLimit", "RateLimiter", "parse_rate_limits"]
+
+import collections
+import logging
+import math
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Union
+
+from redis import RedisError, StrictRedis
+
+from ratelimit.exceptions import RateLimitExceeded
+
+# Retrieves logger
+_logger = logging.getLogger(__name__)
+
+# Refills the bucket for the time elapsed since the last take and takes up to the requested tokens
+# KEYS[1] the bucket, ARGV rate in tokens per ms, burst, requested tokens, now in ms, ttl in ms
+# Returns the granted tokens and, if none was granted, the ms before the next token
+_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[4])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+
+local granted = math.min(math.floor(tokens), tonumber(ARGV[3]))
+tokens = tokens - granted
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+
+if granted > 0 then
+    return {granted, 0}
+end
+return {0, math.ceil((1 - tokens) / rate)}
+"""
+
+# Max seconds the tokens taken in advance from the shared bucket are kept by the process
+_LEASE_TTL = 1.0
+
+
+class RateLimit(NamedTuple):
+    # Tokens added to the bucket each second
+    rate: float
+    # Max tokens of the bucket, the requests accepted at once after a pause
+    burst: int
+
+
+def parse_rate_limits(spec: str) -> Dict[str, RateLimit]:
+    """
+    Parses the limits of the routes from comma separated "{route}={requests}/{seconds}[:{burst}]",
+    e.g. "redirect=100/1:200,get_metrics=10/60", the burst defaults to the requests
+
+    :param spec: the limits
+    :type spec: str
+    :raises ValueError: if the spec is invalid
+    :return: the limit of each route
+    :rtype: Dict[str, RateLimit]
+    """
+    limits = {}
+
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+
+        try:
+            route, limit = item.split("=")
+            limit, _, burst = limit.partition(":")
+            requests, seconds = limit.split("/")
+
+            limits[route.strip()] = RateLimit(float(requests) / float(seconds), int(burst or math.ceil(float(requests))))
+
+        except (ValueError, ZeroDivisionError):
+            raise ValueError("Invalid rate limit \"{}\"".format(item))
+
+    return limits
+
+
+class RateLimiter:
+    """
+    Token buckets of each route and client shared by all the processes that use the same redis db
+
+    A bucket is refilled and taken atomically by a script, but a process doesn't pay a round trip
+    for each request: it takes in advance a lease of a few tokens and spends them locally for at most
+    a second, and it remembers the clients rejected until their next token, so a flood of requests
+    from a client is rejected without touching redis.
+    If redis is unreachable the requests are accepted.
+    """
+
+    def __init__(self,
+                 redis: StrictRedis,
+                 limits: Union[Dict[str, RateLimit], str],
+                 key: str = "!:rate:{}:{}",
+                 lease: float = 0.1,
+                 size: int = 10000):
+        """
+        :param redis: the db of the buckets
+        :type redis: StrictRedis
+        :param limits: the limit of each route, as dict or as spec of parse_rate_limits
+        :type limits: Union[Dict[str, RateLimit], str]
+        :param key: the key of a bucket, formatted with the route and the client
+        :type key: str
+        :param lease: the fraction of the burst taken in advance by the process
+        :type lease: float
+        :param size: max number of buckets kept by the process
+        :type size: int
+        """
+        self._redis = redis
+        self._limits = parse_rate_limits(limits) if isinstance(limits, str) else dict(limits)
+        self._key = key
+        self._lease = lease
+        self._size = size
+
+        self._take = redis.register_script(_TAKE)
+
+        # Tokens leased, lease expiration and rejection expiration of each bucket
+        self._local = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def limited(self, route: str) -> bool:
+        """
+        Returns if the route has a limit
+
+        :param route: the route
+        :type route: str
+        :return: True if the requests of the route are limited
+        :rtype: bool
+        """
+        return route in self._limits
+
+    def check(self, route: str, client: Optional[str] = None, local_only: bool = False) -> bool:
+        """
+        Takes a token from the bucket of the client for the route
+
+        The request is decided by the process if it has a leased token or if the client was rejected,
+        else a lease is taken from the bucket in redis. An event loop can check first with local_only
+        and run the round trip in an executor only when it is needed.
+
+        :param route: the route
+        :type route: str
+        :param client: the client, None to share the bucket among all the clients
+        :type client: Optional[str]
+        :param local_only: if True redis is not called and False is returned when it would be
+        :type local_only: bool
+        :raises RateLimitExceeded: if the bucket is empty
+        :return: True if the request was accepted, False only with local_only if redis has to be called
+        :rtype: bool
+        """
+        limit = self._limits.get(route)
+
+        if limit is None:
+            return True
+
+        bucket = (route, client or "*")
+        now = time.monotonic()
+
+        # Fast path, the bucket is decided by the process
+        with self._lock:
+            state = self._local.get(bucket)
+
+            if state is not None:
+                if now < state[2]:
+                    raise RateLimitExceeded(state[2] - now)
+
+                if state[0] >= 1 and now < state[1]:
+                    state[0] -= 1
+                    return True
+
+        if local_only:
+            return False
+
+        lease = max(int(limit.burst * self._lease), 1)
+        rate = limit.rate / 1000
+
+        try:
+            granted, retry_after = self._take(keys=[self._key.format(*bucket)],
+                                              args=[rate, limit.burst, lease, int(time.time() * 1000),
+                                                    int(limit.burst / rate) + 1000])
+
+        except RedisError as e:
+            _logger.warning("Rate limit of %s not checked: %s", route, e)
+            return True
+
+        with self._lock:
+            if granted:
+                self._local[bucket] = [granted - 1, now + _LEASE_TTL, 0]
+            else:
+                self._local[bucket] = [0, 0, now + retry_after / 1000]
+
+            self._local.move_to_end(bucket)
+
+            while len(self._local) > self._size:
+                self._local.popitem(last=False)
+
+        if not granted:
+            raise RateLimitExceeded(retry_after / 1000)
+
+        return True
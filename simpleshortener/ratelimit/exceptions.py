@@ -0,0 +1,6 @@
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super(RateLimitExceeded, self).__init__("Rate limit exceeded, retry after {:.1f} seconds".format(retry_after))
+
+        # Seconds before a new request can be accepted
+        self.retry_after = retry_after
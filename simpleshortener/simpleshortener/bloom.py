@@ -0,0 +1,113 @@
+import hashlib
+import math
+import struct
+from typing import Iterable
+
+# Header of the serialized filter: magic, bits, hashes, items
+_HEADER = struct.Struct("<4sQBQ")
+_MAGIC = b"SSBF"
+
+
+class BloomFilter:
+    """
+    Compact set of strings that answers if a string is definitely not in the set
+
+    A string that was added is always found, a string that was not added is found
+    with a probability equal to the false positive rate the filter was sized for.
+    The k positions of a string are derived from a single blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        :param capacity: the number of strings that will be added
+        :type capacity: int
+        :param error_rate: the false positive rate when the filter holds capacity strings
+        :type error_rate: float
+        """
+        capacity = max(int(capacity), 1)
+
+        self._bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self._hashes = max(int(round(self._bits / capacity * math.log(2))), 1)
+        self._data = bytearray((self._bits + 7) // 8)
+        self._items = 0
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        """
+        Loads a filter serialized by to_bytes
+
+        :param data: the serialized filter
+        :type data: bytes
+        :raises ValueError: if the data isn't a serialized filter
+        :return: the filter
+        :rtype: BloomFilter
+        """
+        try:
+            magic, bits, hashes, items = _HEADER.unpack_from(data)
+
+        except struct.error:
+            raise ValueError("Invalid filter")
+
+        if magic != _MAGIC or len(data) - _HEADER.size != (bits + 7) // 8:
+            raise ValueError("Invalid filter")
+
+        f = cls.__new__(cls)
+        f._bits = bits
+        f._hashes = hashes
+        f._data = bytearray(data[_HEADER.size:])
+        f._items = items
+
+        return f
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the filter
+
+        :return: the header followed by the bits
+        :rtype: bytes
+        """
+        return _HEADER.pack(_MAGIC, self._bits, self._hashes, self._items) + bytes(self._data)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return ((h1 + i * h2) % self._bits for i in range(self._hashes))
+
+    def add(self, item: str) -> None:
+        for p in self._positions(item):
+            self._data[p >> 3] |= 1 << (p & 7)
+
+        self._items += 1
+
+    def update(self, items: Iterable[str]) -> None:
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        data = self._data
+
+        for p in self._positions(item):
+            if not data[p >> 3] & (1 << (p & 7)):
+                return False
+
+        return True
+
+    def __len__(self) -> int:
+        return self._items
+
+    def stats(self) -> dict:
+        """
+        Returns the size of the filter
+
+        :return: a dict with items, bits, hashes, bytes and the expected false positive rate
+        :rtype: dict
+        """
+        return {
+            "items": self._items,
+            "bits": self._bits,
+            "hashes": self._hashes,
+            "bytes": len(self._data),
+            "error_rate": (1 - math.exp(-self._hashes * self._items / self._bits)) ** self._hashes
+        }
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from telemetry import CACHE_REQUESTS, CACHE_SIZE
+
+
+class UrlCache:
+    """
+    Bounded in-process LRU cache of short -> target with a time to live for each entry
+
+    The cache is tied to a generation of the url db: when the generation changes
+    the whole cache is dropped, so entries are never older than the last sync
+    """
+
+    def __init__(self, size: int = 4096, ttl: float = 60, name: str = "url"):
+        self._size = size
+        self._ttl = ttl
+
+        self._hit = CACHE_REQUESTS.labels(name, "hit")
+        self._miss = CACHE_REQUESTS.labels(name, "miss")
+        self._entries = CACHE_SIZE.labels(name)
+
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._generation: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, short: str) -> Optional[str]:
+        """
+        Returns the cached target for the short url
+
+        :param short: the short url
+        :type short: str
+        :return: the target url or None if it isn't cached or it is expired
+        :rtype: Optional[str]
+        """
+        with self._lock:
+            try:
+                target, expiration = self._data[short]
+
+            except KeyError:
+                self.misses += 1
+                self._miss.inc()
+                return None
+
+            if expiration < time.monotonic():
+                del self._data[short]
+                self.misses += 1
+                self._miss.inc()
+                return None
+
+            self._data.move_to_end(short)
+            self.hits += 1
+            self._hit.inc()
+
+            return target
+
+    def put(self, short: str, target: str) -> None:
+        """
+        Caches the target for the short url evicting the least recently used entry if it is full
+
+        :param short: the short url
+        :type short: str
+        :param target: the target url
+        :type target: str
+        """
+        if self._size <= 0:
+            return
+
+        with self._lock:
+            self._data[short] = (target, time.monotonic() + self._ttl)
+            self._data.move_to_end(short)
+
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+            self._entries.set(len(self._data))
+
+    def invalidate(self, generation: Optional[int] = None) -> bool:
+        """
+        Drops the cache if the generation is different from the cached one
+
+        :param generation: the current generation of the url db, if None the cache is always dropped
+        :type generation: Optional[int]
+        :return: True if the cache was dropped
+        :rtype: bool
+        """
+        with self._lock:
+            if generation is not None and generation == self._generation:
+                return False
+
+            self._data.clear()
+            self._generation = generation
+            self.invalidations += 1
+
+            self._entries.set(0)
+
+            return True
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self._generation
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache
+
+        :return: a dict with size, capacity, hits, misses, evictions and invalidations
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "capacity": self._size,
+                "ttl": self._ttl,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
@@ -1,9 +1,15 @@
 class UrlNotFound(Exception):
     pass
 
+class InvalidMetricsQuery(Exception):
+    pass
+
 class SyncFailed(Exception):
     pass
 
+class SyncInProgress(SyncFailed):
+    pass
+
 class UrlFileNotFound(SyncFailed):
     pass
 
@@ -17,4 +23,7 @@ class UrlFileInvalidSchema(SyncFailed):
     pass
 
 class SyncDbError(SyncFailed):
+    pass
+
+class SyncLockLost(SyncDbError):
     pass
\ No newline at end of file
@@ -0,0 +1,84 @@
+import uuid
+from typing import Optional
+
+from redis import StrictRedis
+
+# Deletes the lock only if it is still owned by who is releasing it
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Renews the expiration of the lock only if it is still owned by who is extending it
+_EXTEND = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """
+    Non blocking lock shared by all the processes that use the same redis db
+
+    The lock expires after ttl seconds, so a crashed owner cannot hold it forever,
+    a long task extends it as it goes and stops if it was lost in the meantime
+    """
+
+    def __init__(self, redis: StrictRedis, key: str, ttl: int):
+        self._redis = redis
+        self._key = key
+        self._ttl = ttl
+
+        self._token = None
+        self._release = redis.register_script(_RELEASE)
+        self._extend = redis.register_script(_EXTEND)
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    @property
+    def token(self) -> Optional[str]:
+        """
+        The random value of the lock while it is acquired, it identifies the owner
+        """
+        return self._token
+
+    def acquire(self) -> bool:
+        """
+        Tries to acquire the lock without waiting
+
+        :return: True if the lock was acquired
+        :rtype: bool
+        """
+        token = uuid.uuid4().hex
+
+        if self._redis.set(self._key, token, nx=True, ex=self._ttl):
+            self._token = token
+            return True
+
+        return False
+
+    def extend(self) -> bool:
+        """
+        Renews the ttl of the lock if it is still owned
+
+        :return: False if the lock was not acquired or it was lost, e.g. it expired and another process took it
+        :rtype: bool
+        """
+        if self._token is None:
+            return False
+
+        return bool(self._extend(keys=[self._key], args=[self._token, self._ttl * 1000]))
+
+    def release(self) -> None:
+        """
+        Releases the lock if it is still owned
+        """
+        if self._token is not None:
+            self._release(keys=[self._key], args=[self._token])
+            self._token = None
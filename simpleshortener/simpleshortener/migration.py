@@ -0,0 +1,129 @@
+import logging
+from datetime import timedelta
+
+from redis import StrictRedis
+
+from .redis_key import *
+
+# Retrieves logger
+_logger = logging.getLogger(__package__)
+
+# Version of the layout of the statistics db
+STATISTICS_LAYOUT_VERSION = 4
+
+# Number of keys migrated for each round trip
+_BATCH = 1000
+
+
+def migrate_statistics(redis: StrictRedis, expiration: timedelta) -> None:
+    """
+    Migrates the statistics db to the current layout if it is needed
+    Only one process at a time runs the migration, the others continue with the db as it is
+
+    :param redis: the statistics db
+    :type redis: StrictRedis
+    :param expiration: the expiration of the statistics
+    :type expiration: timedelta
+    """
+    version = int(redis.get(STATISTICS_VERSION) or 2)
+
+    if version >= STATISTICS_LAYOUT_VERSION:
+        return
+
+    if not redis.set(STATISTICS_MIGRATION_LOCK, version, nx=True, ex=600):
+        _logger.info("Statistics db migration is running in another process")
+        return
+
+    try:
+        if version < 3:
+            _migrate_v3(redis, expiration)
+        if version < 4:
+            _migrate_v4(redis, expiration)
+
+        redis.set(STATISTICS_VERSION, STATISTICS_LAYOUT_VERSION)
+
+    finally:
+        redis.delete(STATISTICS_MIGRATION_LOCK)
+
+
+def _migrate_v3(redis: StrictRedis, expiration: timedelta) -> None:
+    """
+    Moves the "@:{short}:{date}:..." counters in a hash for each short and registers the targets
+    """
+    _logger.info("Migrating the statistics db to the layout v3...")
+
+    # Registers the targets
+    for k in redis.scan_iter(STATISTICS_TARGET_ALL, count=_BATCH):
+        redis.sadd(STATISTICS_TARGETS, k[len(STATISTICS_TARGET_ROOT):])
+
+    total_suffix = STATISTICS_DATE_TOTAL.format(short="", date="")[len(STATISTICS_ROOT_SHORT.format("")) + 1:]
+    user_agent_infix = STATISTICS_USERAGENT.format(short="", date="", user_agent="")[
+                       len(STATISTICS_ROOT_SHORT.format("")) + 1:]
+
+    migrated = 0
+    keys = []
+
+    def migrate(keys):
+        values = redis.mget(keys)
+
+        p = redis.pipeline()
+        for k, v in zip(keys, values):
+            if v is None:
+                continue
+
+            k = k[len(STATISTICS_ROOT_SHORT.format("")):]
+
+            # The short can contain ":" so the key is split from the right
+            if k.endswith(total_suffix):
+                short, d = k[:-len(total_suffix)].rsplit(":", 1)
+                field = STATISTICS_FIELD_TOTAL.format(date=d)
+            else:
+                k, user_agent = k.rsplit(user_agent_infix, 1)
+                short, d = k.rsplit(":", 1)
+                field = STATISTICS_FIELD_USERAGENT.format(date=d, user_agent=user_agent)
+
+            p.hincrby(STATISTICS_HASH.format(short), field, int(v))
+            p.expire(STATISTICS_HASH.format(short), expiration)
+
+        p.delete(*keys)
+        p.execute()
+
+    for k in redis.scan_iter(STATISTICS_ROOT_SHORT.format("*"), count=_BATCH):
+        keys.append(k)
+
+        if len(keys) >= _BATCH:
+            migrate(keys)
+            migrated += len(keys)
+            keys = []
+
+    if keys:
+        migrate(keys)
+        migrated += len(keys)
+
+    _logger.info("Migrated %s statistics keys", migrated)
+
+
+def _migrate_v4(redis: StrictRedis, expiration: timedelta) -> None:
+    """
+    Builds the rollup of each target summing the hashes of its shorts
+    """
+    _logger.info("Migrating the statistics db to the layout v4...")
+
+    for t in redis.smembers(STATISTICS_TARGETS):
+        shorts = list(redis.smembers(STATISTICS_TARGET.format(t)))
+
+        p = redis.pipeline(transaction=False)
+        for short in shorts:
+            p.hgetall(STATISTICS_HASH.format(short))
+
+        rollup = {}
+        for fields in p.execute():
+            for field, v in fields.items():
+                rollup[field] = rollup.get(field, 0) + int(v)
+
+        p = redis.pipeline()
+        p.delete(STATISTICS_ROLLUP.format(t))
+        if rollup:
+            p.hset(STATISTICS_ROLLUP.format(t), mapping=rollup)
+            p.expire(STATISTICS_ROLLUP.format(t), expiration)
+        p.execute()
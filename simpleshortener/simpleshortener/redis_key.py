@@ -2,6 +2,7 @@ STATISTICS_TARGET = "#:{}"
 STATISTICS_TARGET_ROOT = STATISTICS_TARGET.format("")
 STATISTICS_TARGET_ALL = STATISTICS_TARGET.format("*")
 
+# Statistics layout v2, used only by the migration
 STATISTICS_ROOT_SHORT = "@:{}"
 STATISTICS_SHORT = "@:{short}:{}"
 STATISTICS_DATE = "@:{short}:{date}:{}"
@@ -9,3 +10,45 @@ STATISTICS_USERAGENTS = "@:{short}:{date}:user-agent:{}"
 
 STATISTICS_DATE_TOTAL = "@:{short}:{date}:total"
 STATISTICS_USERAGENT = "@:{short}:{date}:user-agent:{user_agent}"
+
+# Statistics layout v3
+STATISTICS_VERSION = "!:version"
+STATISTICS_MIGRATION_LOCK = "!:migration"
+STATISTICS_TARGETS = "!:targets"
+
+STATISTICS_HASH = "$:{}"
+STATISTICS_HASH_ALL = STATISTICS_HASH.format("*")
+
+# Statistics layout v4
+STATISTICS_ROLLUP = "%:{}"
+
+STATISTICS_FIELD_BROWSER = "{date}:browser:{browser}"
+
+# Unique visitors, a HyperLogLog of the fingerprints of the clients for each day of each short and target
+STATISTICS_UNIQUE = "~:{date}:{}"
+STATISTICS_UNIQUE_ROLLUP = "^:{date}:{}"
+
+# Sharded statistics, the signature of the shards of the last rebalance is kept on each shard
+STATISTICS_SHARDS = "!:shards"
+STATISTICS_REBALANCE_LOCK = "!:rebalance"
+STATISTICS_REBALANCE_TMP = "!:rebalance:{}"
+
+# Counters of the closed days of a hash of a short or of a target packed in a string, e.g. "&:$:{short}"
+STATISTICS_PACKED = "&:{}"
+STATISTICS_COMPACTION_LOCK = "!:compaction"
+STATISTICS_COMPACTED = "!:compacted"
+
+STATISTICS_FIELD_TOTAL = "{date}:total"
+STATISTICS_FIELD_USERAGENT = "{date}:user-agent:{user_agent}"
+
+URL_RESERVED = "!:"
+URL_GENERATION = "!:generation"
+URL_TABLE = "!:url:{}"
+URL_FILTER = "!:url-filter:{}"
+URL_SOURCE = "!:source"
+URL_SYNC_SEEN = "!:sync:seen:{}"
+URL_SYNC_LOCK = "!:sync:lock"
+URL_SYNC_SLOT = "!:sync:slot"
+URL_SYNC_LAST = "!:sync:last"
+URL_SYNC_CHANNEL = "!:sync"
+URL_RATE_LIMIT = "!:rate:{}:{}"
@@ -0,0 +1,68 @@
+import bisect
+import hashlib
+from typing import Dict, Iterable, List
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashRing:
+    """
+    Consistent hashing of the names on a list of nodes
+
+    Each node is placed on the ring in many points derived from its name, a name belongs
+    to the node of the first point that follows its hash. Adding a node moves to it only
+    the names between its points and the previous ones, about 1/n of them, and the order
+    of the nodes doesn't matter.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 160):
+        """
+        :param nodes: the names of the nodes, e.g. their urls
+        :type nodes: List[str]
+        :param replicas: the number of points of each node
+        :type replicas: int
+        """
+        if not nodes:
+            raise ValueError("A ring needs at least one node")
+
+        points = sorted((_hash("{}#{}".format(node, i)), n) for n, node in enumerate(nodes) for i in range(replicas))
+
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+        self.size = len(nodes)
+        self.signature = hashlib.sha1("\0".join(sorted(nodes)).encode("utf-8")).hexdigest()
+
+    def node(self, name: str) -> int:
+        """
+        Returns the node of the name
+
+        :param name: the name to place
+        :type name: str
+        :return: the index of the node in the list given to the ring
+        :rtype: int
+        """
+        if self.size == 1:
+            return 0
+
+        i = bisect.bisect(self._hashes, _hash(name))
+
+        return self._nodes[i if i < len(self._nodes) else 0]
+
+    def group(self, names: Iterable[str]) -> Dict[int, List[str]]:
+        """
+        Groups the names by their node
+
+        :param names: the names to place
+        :type names: Iterable[str]
+        :return: the names of each node
+        :rtype: Dict[int, List[str]]
+        """
+        groups = {}
+
+        for name in names:
+            groups.setdefault(self.node(name), []).append(name)
+
+        return groups
@@ -1,144 +1,396 @@
-import json
+import atexit
+import hashlib
+import os
+import tempfile
 import logging
+import threading
+import time
 from collections import Counter
-from datetime import date, timedelta
-from typing import List, Tuple, Union
+from datetime import date, datetime, timedelta
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
-import requests
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import escape
-from redis import StrictRedis
-from schema import Schema, SchemaError
+from markupsafe import escape
+from redis import RedisError, WatchError
 
-from cooldown import CooldownMethod
+from ratelimit import RateLimit, RateLimiter, parse_rate_limits
+from ratelimit.exceptions import RateLimitExceeded
+from telemetry import CACHE_REQUESTS, ENDPOINT, LATENCY, REDIS_ROUNDTRIPS, SYNC_ENTRIES, SYNC_LAST_SUCCESS, \
+    URL_FILTER_BYTES, InstrumentedRedis, timed
+from useragent import UserAgentClassifier
+from .bloom import BloomFilter
+from .cache import UrlCache
 from .exceptions import *
+from .lock import RedisLock
+from .migration import migrate_statistics
 from .redis_key import *
+from .snapshot import UrlSnapshot, open_snapshot, snapshot_lock, write_snapshot
+from .statistics import StatisticsAggregator, StatisticsStore
+from .urlfile import iter_url_file
 
 # Retrieves logger
 _logger = logging.getLogger(__package__)
 
+# Max number of shorts written to the db for each round trip of the sync
+_SYNC_CHUNK = 10000
+
+# Max number of urls whose metrics are cached by each process
+_METRICS_CACHE_SIZE = 256
+
+# Periods the counters of the metrics can be summed in
+_METRICS_GRANULARITIES = ("day", "week", "month")
+
+# Seconds before the end of the sync interval in which another process can claim the next sync
+_SYNC_SLOT_MARGIN = 60
+
+# Limits of the routes that can be overridden, a sync each minute across the deployment
+_RATE_LIMITS = {"sync": RateLimit(1 / 60, 1)}
+
+# A url db not synced for this many sync intervals is reported as stale
+_SYNC_STALE_INTERVALS = 2
+
+# Max seconds between two attempts of the startup tasks when redis is unreachable
+_STARTUP_RETRY_MAX = 60
+
+# Max seconds between two extensions of the sync lock while the url file is downloaded
+_SYNC_LOCK_EXTEND_INTERVAL = 10
+
+# Size of the blocks read from the url file and max size of a remote file kept in memory
+_READ_CHUNK = 65536
+_SPOOL_SIZE = 1024 * 1024
+
+# Gets the target of a short from the url table selected by the generation
+_GET_TARGET = """
+local generation = tonumber(redis.call('GET', KEYS[1]) or '0')
+return redis.call('HGET', KEYS[2] .. (generation % 2), ARGV[1])
+"""
+
+# Gets the targets of many shorts from the url table selected by the generation
+_GET_TARGETS = """
+local generation = tonumber(redis.call('GET', KEYS[1]) or '0')
+return redis.call('HMGET', KEYS[2] .. (generation % 2), unpack(ARGV))
+"""
+
+# Removes from the url table the shorts that are not in the set of the seen ones
+# It removes nothing and returns -1 if the sync lock (KEYS[3]) is not owned anymore by the token ARGV[1]
+_REMOVE_UNSEEN = """
+if redis.call('GET', KEYS[3]) ~= ARGV[1] then
+    return -1
+end
+local removed = 0
+for i = 2, #ARGV do
+    local short = ARGV[i]
+    if redis.call('SISMEMBER', KEYS[2], short) == 0 then
+        removed = removed + redis.call('HDEL', KEYS[1], short)
+    end
+end
+return removed
+"""
+
 
 class SimpleShortener:
     def __init__(self,
                  url_file: str = "./url.json",
                  url_file_expiration: int = 6,
                  redis_url: str = "redis://127.0.0.1:6379/0",
-                 redis_statistics: str = "redis://127.0.0.1:6379/1",
-                 statistics_expiration: Union[timedelta, int] = timedelta(weeks=3)
+                 redis_statistics: Union[str, List[str]] = "redis://127.0.0.1:6379/1",
+                 statistics_expiration: Union[timedelta, int] = timedelta(weeks=3),
+                 url_cache_size: int = 4096,
+                 url_cache_ttl: int = 60,
+                 generation_poll_interval: int = 30,
+                 statistics_flush_interval: int = 1000,
+                 statistics_flush_size: int = 1000,
+                 statistics_queue_size: int = 100000,
+                 url_file_timeout: int = 10,
+                 sync_lock_ttl: int = 600,
+                 redis_max_connections: int = 64,
+                 metrics_cache_ttl: int = 10,
+                 url_filter_error_rate: float = 0.01,
+                 url_snapshot: Optional[str] = None,
+                 rate_limits: Optional[Union[str, Dict[str, RateLimit]]] = None,
+                 user_agent_classifier: Optional[UserAgentClassifier] = None
                  ):
 
         # Saves the position of the url file
         self._url_file = url_file
 
+        # The pooled http session used to retrieve a remote url file is created at the first fetch
+        self._url_file_timeout = int(url_file_timeout)
+        self._session = None
+
         # Saves statistics expiration
         self._statistics_expiration = statistics_expiration if isinstance(statistics_expiration,
                                                                           timedelta) else timedelta(
-            days=statistics_expiration)
+            days=int(statistics_expiration))
+
+        # Init the in-process cache of the url db
+        self._url_cache = UrlCache(size=int(url_cache_size), ttl=int(url_cache_ttl), name="url")
+
+        # Init the classifier of the user agents of the statistics
+        self._user_agent_classifier = user_agent_classifier or UserAgentClassifier()
+
+        # Init the in-process cache of the metrics
+        self._metrics_cache = UrlCache(size=_METRICS_CACHE_SIZE, ttl=int(metrics_cache_ttl), name="metrics")
+        self._generation_poll_interval = int(generation_poll_interval)
+
+        # Inits the filter of the valid shorts, it is loaded with each generation of the url db
+        self._url_filter_error_rate = float(url_filter_error_rate)
+        self._url_filter: Optional[BloomFilter] = None
+        self._url_filter_rejected = 0
+        self._url_filter_passed = 0
+        self._url_filter_false_positives = 0
+        self._url_filter_hit = CACHE_REQUESTS.labels("filter", "hit")
+        self._url_filter_miss = CACHE_REQUESTS.labels("filter", "miss")
+
+        # Opens the snapshot of the url table shared by the processes of the host, so the redirects
+        # are served without redis even before it is reachable
+        self._url_snapshot_path = url_snapshot
+        self._url_snapshot = open_snapshot(url_snapshot) if url_snapshot is not None else None
+
+        # Saves the url db location for the async client
+        self._redis_url_location = redis_url
+        self._redis_max_connections = int(redis_max_connections)
+        self._get_target_async = None
+
+        # Inits the redis clients, they connect at the first command so a worker starts even if redis is down
+        self._redis_url = InstrumentedRedis.from_url(url=redis_url,
+                                                     encoding="utf-8",
+                                                     decode_responses=True,
+                                                     max_connections=self._redis_max_connections)
+        # The statistics can be sharded on a list of dbs, also given as comma separated urls
+        if isinstance(redis_statistics, str):
+            redis_statistics = [u.strip() for u in redis_statistics.split(",") if u.strip()]
+        self._redis_statistics = [InstrumentedRedis.from_url(url=u,
+                                                             encoding="utf-8",
+                                                             decode_responses=True,
+                                                             max_connections=self._redis_max_connections)
+                                  for u in redis_statistics]
+        # The filter of the valid shorts is binary, so it needs a client that doesn't decode the responses
+        self._redis_url_binary = InstrumentedRedis.from_url(url=redis_url, max_connections=2)
+        self._redis_url.db_label = "url"
+        self._redis_url_binary.db_label = "url"
+        for shard in self._redis_statistics:
+            shard.db_label = "statistics"
+
+        # Places the keys on the shards by their urls, so the order of the list doesn't matter
+        self._statistics_store = StatisticsStore(self._redis_statistics, self._statistics_expiration,
+                                                 names=redis_statistics)
+
+        # Looks up the short in the active url table with a single round trip
+        self._get_target = self._redis_url.register_script(_GET_TARGET)
+        self._get_targets = self._redis_url.register_script(_GET_TARGETS)
+        self._remove_unseen = self._redis_url.register_script(_REMOVE_UNSEEN)
+
+        # Inits the token buckets of the routes shared by the processes
+        rate_limits = parse_rate_limits(rate_limits) if isinstance(rate_limits, str) else rate_limits
+        self._rate_limiter = RateLimiter(self._redis_url, dict(_RATE_LIMITS, **(rate_limits or {})), URL_RATE_LIMIT)
+
+        # Only one process at a time across the deployment can sync the db
+        self._sync_lock_ttl = int(sync_lock_ttl)
+        self._sync_lock = RedisLock(self._redis_url, URL_SYNC_LOCK, self._sync_lock_ttl)
+        self._sync_interval = int(url_file_expiration) * 3600
+
+        # Starts the background writer of the statistics
+        self._statistics = StatisticsAggregator(self._write_statistics,
+                                                flush_interval=int(statistics_flush_interval),
+                                                flush_size=int(statistics_flush_size),
+                                                queue_size=int(statistics_queue_size))
+
+        # Flushes the pending statistics on shutdown
+        atexit.register(self.close)
+
+        # Starts the watcher that drops the cache when the url db changes
+        self._generation_watcher = threading.Thread(target=self._watch_generation,
+                                                    name="generation-watcher",
+                                                    daemon=True)
+        self._generation_watcher.start()
+
+        # Runs the migrations, the first sync and the scheduler in background, the redirects are served
+        # from the url db left by the previous run in the meantime
+        self._scheduler = None
+        self._startup_state = "running"
+        self._startup = threading.Thread(target=self._start, name="startup", daemon=True)
+        self._startup.start()
+
+    def _start(self) -> None:
+        """
+        Runs the startup tasks, retrying them until redis is reachable
 
-        # Init and test redis connection
+        The statistics are moved to the current layout and rebalanced on the shards, the db is synced
+        if no other process did it in this interval and the background jobs are scheduled.
+        The jobs are scheduled also if a task fails, the state is then "failed".
+        """
+        started = time.monotonic()
+        delay = 1
+        failed = False
+
+        while True:
+            try:
+                # Moves the statistics to the current layout
+                for shard in self._redis_statistics:
+                    migrate_statistics(shard, self._statistics_expiration)
+
+                self._statistics_store.rebalance()
+                break
+
+            except RedisError as e:
+                _logger.warning("Startup error, retrying in %ss: %s", delay, e)
+                self._startup_state = "retrying"
+                time.sleep(delay)
+                delay = min(delay * 2, _STARTUP_RETRY_MAX)
+
+            except Exception:
+                # An error that a retry doesn't fix, e.g. an unexpected key of the statistics db
+                _logger.exception("Statistics migration failed")
+                failed = True
+                break
+
+        # Updates the db if no other process did it in this interval
         try:
-            self._redis_url = StrictRedis.from_url(url=redis_url,
-                                                   charset="utf-8",
-                                                   decode_responses=True)
-            self._redis_statistics = StrictRedis.from_url(url=redis_statistics,
-                                                          charset="utf-8",
-                                                          decode_responses=True)
-            self._redis_url.ping()
-            self._redis_statistics.ping()
-
-        except ConnectionError as e:
-            _logger.fatal("Redis error: {}".format(e.__str__()))
-            raise
+            self._scheduled_sync()
 
-        try:
-            # Updates the db
-            self.sync()
+        except Exception:
+            _logger.exception("Startup sync failed")
+            failed = True
 
-        except SyncFailed:
-            _logger.warning("An error occurred in an attempt to sync the db")
+        # Imported here as it is needed only by the background jobs
+        from apscheduler.schedulers.background import BackgroundScheduler
 
         # Creates background scheduler for update the db
         self._scheduler = BackgroundScheduler(daemon=True)
 
-        self._scheduler.add_job(lambda: self.sync(), 'interval', hours=int(url_file_expiration))
+        self._scheduler.add_job(self._scheduled_sync, 'interval', seconds=self._sync_interval)
+
+        # Packs the closed days of the statistics, the first process of each day does it
+        self._scheduler.add_job(self._compact_statistics, 'interval', hours=1, next_run_time=datetime.now())
 
         # Starts the scheduler
         self._scheduler.start()
 
-    @CooldownMethod(60)
+        self._startup_state = "failed" if failed else "done"
+        _logger.info("Startup completed in %.1fs", time.monotonic() - started)
+
+    def _scheduled_sync(self) -> None:
+        """
+        Syncs the db if it is the first process to claim the current interval
+        The other processes get the new generation through the generation watcher
+        """
+        # The slot expires a bit before the interval so the next tick of any process can claim it
+        if not self._redis_url.set(URL_SYNC_SLOT, os.getpid(), nx=True,
+                                   ex=max(self._sync_interval - _SYNC_SLOT_MARGIN, 1)):
+            _logger.debug("The db was already synced in this interval by another process")
+            return
+
+        try:
+            self.sync()
+
+        except (SyncInProgress, RateLimitExceeded):
+            _logger.warning("An error occurred in an attempt to sync the db")
+
+        except SyncFailed:
+            _logger.warning("An error occurred in an attempt to sync the db")
+
+            # Frees the interval, so another process can retry without waiting for the next one
+            self._redis_url.delete(URL_SYNC_SLOT)
+
+    @timed("sync")
     def sync(self) -> None:
         """
         Tries to update the url db
+        It runs only if no other process is syncing the db and the rate limit of the syncs allows it
 
+        :raises RateLimitExceeded: if the db was synced too recently
+        :raises SyncInProgress: if another process is syncing the db
         :raises UrlFileNotFound: if the local file wasn't found
         :raises UrlFileRecoveryFailed: if the remote file wasn't retrieved
         :raises UrlFileInvalidJSON: if the file was invalid JSON
         :raises UrlFileInvalidSchema: if the data didn't have the right scheme
+        :raises SyncLockLost: if the sync took longer than the lock and another process took it
         :raises SyncDbError: if an db error has occurred
         :raises SyncFailed: if sync was failed
         """
-        _logger.info("Try to load url list...")
+        self._rate_limiter.check("sync")
+
+        if not self._sync_lock.acquire():
+            _logger.info("Another process is syncing the db")
+            raise SyncInProgress
 
         try:
-            # Check if the resource is remote
-            if bool(urlparse(self._url_file).scheme):
-                # Load the remote json
-                response = requests.get(self._url_file)
-                data = response.json()
+            self._sync()
 
-            else:
-                # Open the gyms file and load it as json
-                with open(self._url_file, 'r') as f:
-                    data = json.load(f)
+        finally:
+            self._sync_lock.release()
+
+    def _sync(self) -> None:
+        _logger.info("Try to load url list...")
+
+        # Gets what was loaded by the last sync, it is valid only if the url db was not lost
+        p = self._redis_url.pipeline(transaction=False)
+        p.exists(URL_GENERATION)
+        p.hgetall(URL_SOURCE)
+        exists, source = p.execute()
+
+        if not exists or source.get("file") != self._url_file:
+            source = {}
+
+        try:
+            f, metadata = self._fetch_url_file(source)
 
         except FileNotFoundError:
             _logger.warning("Failed to load the url list: file not found")
             raise UrlFileNotFound
 
-        except requests.exceptions.ConnectionError:
-            _logger.warning("Failed to load the url list: an HTTP error has occurred")
+        except OSError as e:
+            # E.g. the path is a directory or it isn't readable
+            _logger.warning("Failed to load the url list: %s", e)
             raise UrlFileRecoveryFailed
 
-        except ValueError:
-            _logger.warning("Failed to load the url list: failed to decode json")
-            raise UrlFileInvalidJSON
-
-        # tests the data schema
-        schema = Schema([
-            {
-                "target": str,
-                "short": [str]
-            }
-        ])
-        try:
-            data = schema.validate(data)
+        if f is None:
+            self._synced()
+            _logger.info("Url list not modified")
+            return
 
-        except SchemaError:
-            _logger.warning("Failed to load the url list: invalid schema of the json")
-            raise UrlFileInvalidSchema
+        with f:
+            metadata["file"] = self._url_file
 
-        p = self._redis_url.pipeline()
-        p_s = self._redis_statistics.pipeline()
-        p.flushdb()
+            if metadata["digest"] == source.get("digest"):
+                # Saves the new metadata so the next fetch can be skipped
+                self._save_source(metadata)
+                self._synced()
+                _logger.info("Url list unchanged")
+                return
 
-        # Inserts the short and the target in the url db
-        for u in data:
-            t = escape(u["target"])
-            for s in [escape(v) for v in u["short"]]:
-                p.set(s, t)
-                p_s.sadd(STATISTICS_TARGET.format(t), s)
+            try:
+                generation, entries = self._write_url_table(iter_url_file(f))
 
-        try:
-            p.execute()
-            p_s.execute()
+            except UrlFileInvalidJSON:
+                _logger.warning("Failed to load the url list: failed to decode json")
+                raise
+
+            except UrlFileInvalidSchema:
+                _logger.warning("Failed to load the url list: invalid schema of the json")
+                raise
+
+            except SyncLockLost:
+                _logger.warning("Failed to load the url list: the sync lock was lost")
+                raise
+
+            except Exception as e:
+                _logger.warning("Failed to load the url list: an db error has occurred (%s)", e)
+                raise SyncDbError
+
+        # Remembers what was loaded to skip the next sync if nothing changes
+        self._save_source(metadata)
 
-        except:
-            _logger.warning("Failed to load the url list: an db error has occurred")
-            raise SyncDbError
+        # Drops the local cache without waiting the notification
+        self._switch_generation(generation)
 
-        _logger.info("Sync was completed")
+        SYNC_ENTRIES.set(entries)
+        self._synced()
 
+        _logger.info("Sync was completed (generation %s, %s shorts)", generation, entries)
+
+    @timed("get_url")
     def get_url(self, url: str) -> str:
         """
         Provided the short url returns the target url
@@ -158,52 +410,715 @@ class SimpleShortener:
 
         url = escape(url)
 
-        _logger.debug("try to found \"{}\"".format(url))
+        _logger.debug("try to found \"%s\"", url)
+
+        # Serves the short from the snapshot of the url table if it is enabled
+        snapshot = self._url_snapshot
+        if snapshot is not None:
+            return self._get_url_from_snapshot(snapshot, url)
+
+        # Checks the local cache before hitting the db
+        target = self._url_cache.get(url)
+        if target is not None:
+            return target
+
+        # Rejects the shorts that are surely unknown without hitting the db
+        if not self._url_filter_allows(url):
+            raise UrlNotFound
+
+        target = self._get_target(keys=[URL_GENERATION, URL_TABLE.format("")], args=[url])
+
+        if target is None:
+            self._url_filter_missed(url)
+            raise UrlNotFound
+
+        self._url_cache.put(url, target)
+
+        return target
+
+    async def get_url_async(self, url: str) -> str:
+        """
+        Provided the short url returns the target url, like get_url but with the async redis client
+
+        :param url: the short url without the root slash
+        :type url: str
+        :raises UrlNotFound: if the short url doesn't exist
+        :return: the target url
+        :rtype: str
+        """
+
+        with LATENCY.labels("get_url_async").time():
+            return await self._get_url_async(escape(url))
+
+    async def _get_url_async(self, url: str) -> str:
+        # Serves the short from the snapshot of the url table if it is enabled
+        snapshot = self._url_snapshot
+        if snapshot is not None:
+            return self._get_url_from_snapshot(snapshot, url)
+
+        # Checks the local cache before hitting the db
+        target = self._url_cache.get(url)
+        if target is not None:
+            return target
+
+        # Rejects the shorts that are surely unknown without hitting the db
+        if not self._url_filter_allows(url):
+            raise UrlNotFound
+
+        if self._get_target_async is None:
+            # The async client is bound to the running event loop, so it is created at the first use
+            from redis.asyncio import StrictRedis as AsyncStrictRedis
+
+            redis = AsyncStrictRedis.from_url(url=self._redis_url_location,
+                                              encoding="utf-8",
+                                              decode_responses=True,
+                                              max_connections=self._redis_max_connections)
+            self._get_target_async = redis.register_script(_GET_TARGET)
+
+        # Records the round trip as InstrumentedRedis does for the blocking client
+        start = time.perf_counter()
+
+        try:
+            target = await self._get_target_async(keys=[URL_GENERATION, URL_TABLE.format("")], args=[url])
+
+        finally:
+            REDIS_ROUNDTRIPS.labels(ENDPOINT.get(), "url").observe(time.perf_counter() - start)
 
-        if not self._redis_url.exists(url):
-            _logger.debug("\"{}\" not found".format(url))
+        if target is None:
+            self._url_filter_missed(url)
             raise UrlNotFound
 
-        return self._redis_url.get(url)
+        self._url_cache.put(url, target)
+
+        return target
+
+    @staticmethod
+    def _get_url_from_snapshot(snapshot: UrlSnapshot, url: str) -> str:
+        target = snapshot.get(url)
+
+        if target is None:
+            _logger.debug("\"%s\" not found", url)
+            raise UrlNotFound
+
+        return target
+
+    def _fetch_url_file(self, source: Dict[str, str]) -> Tuple[Optional[BinaryIO], Dict[str, str]]:
+        """
+        Retrieves the url file if it was modified since the last sync
+
+        A remote file is requested with If-None-Match and If-Modified-Since and it is streamed
+        in a spooled temporary file, a local file is read only if its modification time is changed.
+        The sha256 of the content is computed while it is read and returned in the metadata.
+
+        :param source: the metadata saved by the last sync
+        :type source: Dict[str, str]
+        :raises FileNotFoundError: if the local file wasn't found
+        :raises OSError: if the local file wasn't read, e.g. it is a directory
+        :raises UrlFileRecoveryFailed: if the remote file wasn't retrieved
+        :return: the file opened in binary mode, or None if it wasn't modified, and the new metadata
+        :rtype: Tuple[Optional[BinaryIO], Dict[str, str]]
+        """
+        digest = hashlib.sha256()
+
+        # Check if the resource is remote
+        if bool(urlparse(self._url_file).scheme):
+            headers = {}
+
+            if "etag" in source:
+                headers["If-None-Match"] = source["etag"]
+            if "last-modified" in source:
+                headers["If-Modified-Since"] = source["last-modified"]
+
+            from requests import RequestException
+
+            try:
+                with self._http_session().get(self._url_file, headers=headers, timeout=self._url_file_timeout,
+                                              stream=True) as response:
+                    if response.status_code == 304:
+                        return None, {}
+
+                    response.raise_for_status()
+
+                    metadata = {}
+                    if "ETag" in response.headers:
+                        metadata["etag"] = response.headers["ETag"]
+                    if "Last-Modified" in response.headers:
+                        metadata["last-modified"] = response.headers["Last-Modified"]
+
+                    f = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+
+                    # The timeout applies to each read, so the lock is extended while the file is downloaded
+                    extended = time.monotonic()
+
+                    for chunk in response.iter_content(_READ_CHUNK):
+                        digest.update(chunk)
+                        f.write(chunk)
+
+                        if time.monotonic() - extended > _SYNC_LOCK_EXTEND_INTERVAL:
+                            self._extend_sync_lock()
+                            extended = time.monotonic()
+
+            except RequestException as e:
+                _logger.warning("Failed to load the url list: an HTTP error has occurred (%s)", e)
+                raise UrlFileRecoveryFailed
+
+        else:
+            mtime = str(os.stat(self._url_file).st_mtime_ns)
+
+            if mtime == source.get("mtime"):
+                return None, {}
+
+            metadata = {"mtime": mtime}
+
+            f = open(self._url_file, "rb")
+
+            for chunk in iter(lambda: f.read(_READ_CHUNK), b""):
+                digest.update(chunk)
+
+        f.seek(0)
+        metadata["digest"] = digest.hexdigest()
+
+        return f, metadata
+
+    def _http_session(self):
+        """
+        Returns the pooled http session used to retrieve a remote url file, requests is imported at the first use
+        """
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2,
+                                  max_retries=Retry(total=3, backoff_factor=0.5))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            self._session = session
+
+        return self._session
+
+    def _extend_sync_lock(self) -> None:
+        """
+        Renews the sync lock before a step of the sync
+
+        :raises SyncLockLost: if the lock expired and it could be owned by another process
+        """
+        if not self._sync_lock.extend():
+            raise SyncLockLost
+
+    def _synced(self) -> None:
+        """
+        Records the time of a successful sync, also when the url file was unchanged
+        """
+        SYNC_LAST_SUCCESS.set_to_current_time()
+
+        try:
+            self._redis_url.set(URL_SYNC_LAST, int(time.time()))
+
+        except RedisError as e:
+            _logger.warning("Failed to save the time of the sync: %s", e)
+
+    def _save_source(self, metadata: Dict[str, str]) -> None:
+        p = self._redis_url.pipeline()
+        p.delete(URL_SOURCE)
+        p.hset(URL_SOURCE, mapping=metadata)
+        p.execute()
+
+    def _write_url_table(self, entries: Iterator[dict]) -> Tuple[int, int]:
+        """
+        Writes the entries of the url file in the inactive url table and switches the active table
+
+        The url db has two hashes (URL_TABLE) and the active one is selected by the parity of
+        the generation, so the lookups see either the old or the new mapping and never an empty db.
+        The entries are written in chunks and only the differences with the inactive table are written,
+        the shorts seen are collected in a set of the db to find the ones to remove.
+
+        :param entries: the entries of the url file
+        :type entries: Iterator[dict]
+        :raises SyncLockLost: if the sync lock was lost, nothing is removed and the table isn't switched
+        :raises SyncDbError: if another sync has switched the table in the meantime
+        :return: the new generation and the number of shorts
+        :rtype: Tuple[int, int]
+        """
+        current = self._redis_url.get(URL_GENERATION)
+
+        generation = int(current or 0) + 1
+        table = URL_TABLE.format(generation % 2)
+        old_table = URL_TABLE.format((generation + 1) % 2)
+
+        # The set of the seen shorts is owned by the lock, a sync that lost it cannot mix its shorts with another one
+        token = self._sync_lock.token
+        seen = URL_SYNC_SEEN.format(token)
+
+        total = 0
+        changed = 0
+        removed = 0
+
+        def write(chunk: Dict[str, str]):
+            self._extend_sync_lock()
+
+            shorts = list(chunk)
+            old = self._redis_url.hmget(table, shorts)
+            update = {s: chunk[s] for s, t in zip(shorts, old) if t != chunk[s]}
+
+            p = self._redis_url.pipeline(transaction=False)
+            if update:
+                p.hset(table, mapping=update)
+            p.sadd(seen, *shorts)
+            p.expire(seen, self._sync_lock_ttl)
+            p.execute()
+
+            return len(update)
+
+        try:
+            chunk = {}
+
+            for u in entries:
+                t = escape(u["target"])
+                for v in u["short"]:
+                    chunk[escape(v)] = t
+
+                if len(chunk) >= _SYNC_CHUNK:
+                    total += len(chunk)
+                    changed += write(chunk)
+                    chunk = {}
+
+            if chunk:
+                total += len(chunk)
+                changed += write(chunk)
+
+            # Removes the shorts that are not in the url file anymore
+            for shorts in self._hscan_chunks(table):
+                self._extend_sync_lock()
+
+                n = self._remove_unseen(keys=[table, seen, self._sync_lock.key], args=[token] + shorts)
+                if n < 0:
+                    raise SyncLockLost
+
+                removed += n
+
+        finally:
+            self._redis_url.delete(seen)
+
+        _logger.info("Url table %s updated: %s changed, %s removed", table, changed, removed)
+
+        # Builds the filter of the valid shorts that the processes load with the new generation
+        self._write_url_filter(table, URL_FILTER.format(generation % 2))
+
+        # Switches the active table only if no one else did it and the lock is still owned
+        with self._redis_url.pipeline() as p:
+            try:
+                p.watch(URL_GENERATION, self._sync_lock.key)
+
+                if p.get(self._sync_lock.key) != token:
+                    raise SyncLockLost
+
+                if p.get(URL_GENERATION) != current:
+                    raise SyncDbError
+
+                p.multi()
+                p.set(URL_GENERATION, generation)
+                p.publish(URL_SYNC_CHANNEL, generation)
+                p.execute()
+
+            except WatchError:
+                raise SyncDbError
+
+        # Updates the shorts of the targets in the statistics db
+        if current is None:
+            # The first sync checks all the targets since the statistics db could have stale sets
+            self._statistics_store.reconcile_targets(
+                lambda shorts: self._redis_url.hmget(table, shorts))
+
+            # Removes the keys of the layout without tables
+            legacy = [k for k in self._redis_url.scan_iter(count=_SYNC_CHUNK) if not k.startswith(URL_RESERVED)]
+
+            for i in range(0, len(legacy), _SYNC_CHUNK):
+                self._redis_url.delete(*legacy[i:i + _SYNC_CHUNK])
 
-    def update_url_statistics(self, short: str, user_agent: str = None) -> None:
+        self._statistics_store.update_targets(self._diff_url_tables(old_table, table))
+
+        return generation, total
+
+    def _hscan_chunks(self, table: str) -> Iterator[List[str]]:
+        """
+        Iterates over the fields of a url table in chunks without blocking the db
+        """
+        cursor = None
+
+        while cursor != 0:
+            cursor, fields = self._redis_url.hscan(table, cursor or 0, count=_SYNC_CHUNK)
+            if fields:
+                yield list(fields)
+
+    def _diff_url_tables(self, old_table: str, table: str) -> Iterator[List[Tuple[str, Optional[str], Optional[str]]]]:
+        """
+        Iterates in chunks over the shorts whose target differs between two url tables
+
+        :return: chunks of (short, old target, new target), the target is None if the short is missing
+        :rtype: Iterator[List[Tuple[str, Optional[str], Optional[str]]]]
+        """
+        for shorts in self._hscan_chunks(table):
+            p = self._redis_url.pipeline(transaction=False)
+            p.hmget(table, shorts)
+            p.hmget(old_table, shorts)
+            new, old = p.execute()
+
+            yield [(s, o, n) for s, o, n in zip(shorts, old, new) if o != n]
+
+        for shorts in self._hscan_chunks(old_table):
+            p = self._redis_url.pipeline(transaction=False)
+            p.hmget(old_table, shorts)
+            p.hmget(table, shorts)
+            old, new = p.execute()
+
+            yield [(s, o, None) for s, o, n in zip(shorts, old, new) if n is None]
+
+    def _write_url_filter(self, table: str, key: str) -> None:
+        """
+        Writes in the url db the filter of the shorts of a url table
+        """
+        if self._url_filter_error_rate <= 0:
+            self._redis_url.delete(key)
+            return
+
+        url_filter = BloomFilter(self._redis_url.hlen(table), self._url_filter_error_rate)
+
+        for shorts in self._hscan_chunks(table):
+            url_filter.update(shorts)
+
+        self._redis_url_binary.set(key, url_filter.to_bytes())
+
+        _logger.info("Url filter %s updated: %s shorts in %s bytes", key, len(url_filter), url_filter.stats()["bytes"])
+
+    def _load_url_filter(self, generation: int) -> None:
+        """
+        Loads the filter of the valid shorts of the generation, the filter is disabled if it is missing
+        """
+        if self._url_filter_error_rate <= 0:
+            return
+
+        url_filter = None
+        data = self._redis_url_binary.get(URL_FILTER.format(generation % 2))
+
+        if data is not None:
+            try:
+                url_filter = BloomFilter.from_bytes(data)
+
+            except ValueError:
+                _logger.warning("Invalid url filter for the generation %s", generation)
+
+        self._url_filter = url_filter
+        URL_FILTER_BYTES.set(url_filter.stats()["bytes"] if url_filter is not None else 0)
+
+    def _switch_generation(self, generation: int) -> bool:
+        """
+        Drops the url cache and loads the url filter if the generation of the url db is changed
+
+        :return: True if the generation is changed
+        :rtype: bool
+        """
+        if not self._url_cache.invalidate(generation):
+            return False
+
+        self._load_url_filter(generation)
+        self._refresh_url_snapshot(generation)
+
+        return True
+
+    def _refresh_url_snapshot(self, generation: int) -> None:
+        """
+        Brings the snapshot of the url table to the generation
+        The first process of the host that sees the generation writes the snapshot, the others open it
+        """
+        if self._url_snapshot_path is None:
+            return
+
+        snapshot = self._url_snapshot
+
+        try:
+            if snapshot is None or snapshot.generation != generation:
+                snapshot = open_snapshot(self._url_snapshot_path)
+
+            if snapshot is None or snapshot.generation != generation:
+                with snapshot_lock(self._url_snapshot_path) as acquired:
+                    # Another process of the host is writing it, the generation watcher retries later
+                    if not acquired:
+                        return
+
+                    snapshot = open_snapshot(self._url_snapshot_path)
+
+                    if snapshot is None or snapshot.generation != generation:
+                        write_snapshot(self._url_snapshot_path, generation,
+                                       self._redis_url.hscan_iter(URL_TABLE.format(generation % 2),
+                                                                  count=_SYNC_CHUNK))
+                        snapshot = open_snapshot(self._url_snapshot_path)
+
+                        _logger.info("Url snapshot written (generation %s, %s shorts)",
+                                     generation, snapshot.entries if snapshot is not None else 0)
+
+        except Exception as e:
+            _logger.warning("Failed to refresh the url snapshot: %s", e)
+            return
+
+        # The previous snapshot is unmapped when the last lookup using it returns
+        self._url_snapshot = snapshot
+
+    def _url_filter_allows(self, url: str) -> bool:
+        """
+        Returns False if the short is surely not in the url db, True if it could be or there is no filter
+
+        The filter is the one of the generation seen by the generation watcher, so a short added by a sync
+        of another process is rejected until the notification of the switch is received, usually a few
+        milliseconds. The filter is dropped while the watcher isn't subscribed, so the window is bounded
+        by the delivery of the notification and not by the poll interval.
+        """
+        url_filter = self._url_filter
+
+        if url_filter is None:
+            return True
+
+        if url in url_filter:
+            self._url_filter_passed += 1
+            self._url_filter_miss.inc()
+            return True
+
+        self._url_filter_rejected += 1
+        self._url_filter_hit.inc()
+        _logger.debug("\"%s\" rejected by the url filter", url)
+
+        return False
+
+    def _url_filter_missed(self, url: str) -> None:
+        """
+        Accounts a short that is not in the url db but that was allowed by the filter
+        """
+        if self._url_filter is not None:
+            self._url_filter_false_positives += 1
+
+        _logger.debug("\"%s\" not found", url)
+
+    def get_cache_stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the in-process url cache, of the url filter and of the url snapshot
+
+        :return: the stats of the url cache, with the stats of the url filter and snapshot under "filter" and "snapshot"
+        :rtype: dict
+        """
+        stats = self._url_cache.stats()
+
+        url_filter = self._url_filter
+        stats["filter"] = None if url_filter is None else dict(url_filter.stats(),
+                                                               target_error_rate=self._url_filter_error_rate,
+                                                               rejected=self._url_filter_rejected,
+                                                               passed=self._url_filter_passed,
+                                                               false_positives=self._url_filter_false_positives)
+
+        snapshot = self._url_snapshot
+        stats["snapshot"] = None if snapshot is None else snapshot.stats()
+
+        return stats
+
+    def get_status(self) -> dict:
+        """
+        Returns the readiness of the process: the connectivity of the redis dbs, the freshness of the url db
+        and the state of the startup tasks
+
+        The process is ready if it can resolve the shorts, from the url db or from the url snapshot,
+        even if the first sync is still running or the data is stale.
+
+        :return: "ready", "startup" ("running", "retrying", "done" or "failed"), "redis" with the connectivity of "url"
+                 and of each "statistics" shard, "generation", "snapshot", "last_sync", "sync_age" and "stale"
+        :rtype: dict
+        """
+        redis = {"url": True, "statistics": []}
+        generation = None
+        last_sync = None
+
+        try:
+            p = self._redis_url.pipeline(transaction=False)
+            p.get(URL_GENERATION)
+            p.get(URL_SYNC_LAST)
+            generation, last_sync = p.execute()
+
+        except RedisError as e:
+            _logger.debug("Url db unreachable: %s", e)
+            redis["url"] = False
+
+        for shard in self._redis_statistics:
+            try:
+                redis["statistics"].append(bool(shard.ping()))
+
+            except RedisError:
+                redis["statistics"].append(False)
+
+        snapshot = self._url_snapshot
+        sync_age = int(time.time()) - int(last_sync) if last_sync is not None else None
+
+        return {
+            "ready": (redis["url"] and generation is not None) or snapshot is not None,
+            "startup": self._startup_state,
+            "redis": redis,
+            "generation": int(generation) if generation is not None else None,
+            "snapshot": snapshot.generation if snapshot is not None else None,
+            "last_sync": datetime.fromtimestamp(int(last_sync)).isoformat() if last_sync is not None else None,
+            "sync_age": sync_age,
+            "stale": sync_age is None or sync_age > self._sync_interval * _SYNC_STALE_INTERVALS
+        }
+
+    def _watch_generation(self) -> None:
+        """
+        Listens the sync notifications and drops the url cache when the generation of the url db changes
+        It polls also the generation periodically in case a notification was lost
+        """
+        while True:
+            pubsub = self._redis_url.pubsub(ignore_subscribe_messages=True)
+
+            try:
+                pubsub.subscribe(URL_SYNC_CHANNEL)
+
+                generation = int(self._redis_url.get(URL_GENERATION) or 0)
+                if not self._switch_generation(generation) and self._url_filter is None:
+                    self._load_url_filter(generation)
+
+                while True:
+                    message = pubsub.get_message(timeout=self._generation_poll_interval)
+
+                    if message is not None:
+                        generation = int(message["data"])
+                    else:
+                        generation = int(self._redis_url.get(URL_GENERATION) or 0)
+
+                    if self._switch_generation(generation):
+                        _logger.debug("url cache dropped (generation %s)", generation)
+
+                    else:
+                        # Retries to load a filter that was missing, e.g. written by a newer process
+                        if self._url_filter is None:
+                            self._load_url_filter(generation)
+
+                        # Retries to refresh a snapshot that another process of the host was writing
+                        snapshot = self._url_snapshot
+                        if snapshot is None or snapshot.generation != generation:
+                            self._refresh_url_snapshot(generation)
+
+            except Exception as e:
+                _logger.warning("Generation watcher error: %s", e)
+                self._url_cache.invalidate()
+
+                # The switches can't be seen until the watcher subscribes again, so the shorts added
+                # meanwhile would be rejected: the filter is dropped and reloaded by the watcher
+                self._url_filter = None
+                URL_FILTER_BYTES.set(0)
+
+                pubsub.close()
+                time.sleep(self._generation_poll_interval)
+
+    def rate_limited(self, route: str) -> bool:
+        """
+        Returns if the route has a rate limit
+
+        :param route: the name of the route, e.g. the endpoint of the web app
+        :type route: str
+        :return: True if the requests of the route are limited
+        :rtype: bool
+        """
+        return self._rate_limiter.limited(route)
+
+    def check_rate_limit(self, route: str, client: Optional[str] = None, local_only: bool = False) -> bool:
+        """
+        Takes a token from the bucket of the client for the route
+
+        :param route: the name of the route, e.g. the endpoint of the web app
+        :type route: str
+        :param client: the address of the client, None to share the bucket among all the clients
+        :type client: Optional[str]
+        :param local_only: if True the request is decided only with the tokens leased by the process,
+                           without a round trip to redis
+        :type local_only: bool
+        :raises RateLimitExceeded: if the client exceeded the rate limit of the route
+        :return: True if the request was accepted, False only with local_only if redis has to be checked
+        :rtype: bool
+        """
+        return self._rate_limiter.check(route, client, local_only)
+
+    @timed("compact_statistics")
+    def _compact_statistics(self) -> None:
+        """
+        Packs the counters of the days before yesterday, yesterday can still get the events of a late flush
+        """
+        ENDPOINT.set("compaction")
+
+        today = date.today()
+
+        try:
+            compacted = self._statistics_store.compact((today - timedelta(days=1)).strftime("%Y-%m-%d"),
+                                                       (today - self._statistics_expiration).strftime("%Y-%m-%d"))
+
+        except Exception as e:
+            _logger.warning("Statistics compaction error: %s", e)
+            return
+
+        if compacted:
+            _logger.info("Packed the statistics of %s urls", compacted)
+
+    @timed("update_url_statistics")
+    def update_url_statistics(self, short: str, user_agent: str = None, client: str = None) -> None:
         """
         Updates the statistics for the short url provided with count and operation system is used by the user
+        The update is queued and written in batch by a background thread, see StatisticsAggregator
 
         :param short: a short url
         :type short: str
         :param user_agent: a user agent string, defaults to None
         :type user_agent: str, optional
+        :param client: the address of the client, used with the user agent to count the unique visitors
+        :type client: str, optional
         """
 
-        s = escape(short)
-        p = self._redis_statistics.pipeline()
+        self._statistics.record(escape(short), date.today().strftime("%Y-%m-%d"), user_agent, client)
 
-        d = date.today().strftime("%Y-%m-%d")
+    def close(self) -> None:
+        """
+        Stops the background jobs and flushes the pending statistics
+        """
+        self._statistics.close()
+        self._statistics_store.close()
 
-        total_key = STATISTICS_DATE_TOTAL.format(short=s, date=d)
-        p.incr(total_key)
-        p.expire(total_key, self._statistics_expiration)
+    def _write_statistics(self, events: Counter) -> None:
+        """
+        Writes a batch of statistics events in the statistics db with a single pipeline
 
-        if user_agent is not None:
-            if "Windows" in user_agent:
-                user_agent = "windows"
-            elif "Macintosh" in user_agent:
-                user_agent = "mac"
-            elif "iPhone" in user_agent:
-                user_agent = "ios"
-            elif "Android" in user_agent:
-                user_agent = "android"
-            elif "Linux" in user_agent:
-                user_agent = "linux"
-            else:
-                user_agent = "other"
+        :param events: the number of hits for each (short, date, user agent, client)
+        :type events: Counter
+        """
+        ENDPOINT.set("statistics")
 
-            useragent_key = STATISTICS_USERAGENT.format(short=s, date=d, user_agent=user_agent)
-            p.incr(useragent_key)
-            p.expire(useragent_key, self._statistics_expiration)
+        counters = Counter()
+        uniques = {}
 
-        p.execute()
+        for (s, d, user_agent, client), n in events.items():
+            counters[(s, STATISTICS_FIELD_TOTAL.format(date=d))] += n
+
+            # Only a hash of the client is stored
+            if client is not None:
+                fingerprint = hashlib.blake2b("{}\0{}".format(client, user_agent or "").encode("utf-8"),
+                                              digest_size=8).hexdigest()
+                uniques.setdefault((s, d), set()).add(fingerprint)
+
+            if user_agent is not None:
+                user_agent = self._user_agent_classifier.classify(user_agent)
+
+                counters[(s, STATISTICS_FIELD_USERAGENT.format(date=d, user_agent=user_agent.os))] += n
+                counters[(s, STATISTICS_FIELD_BROWSER.format(date=d, browser=user_agent.browser))] += n
+
+        # Resolves the targets of the shorts for the rollups
+        shorts = list({s for s, _ in counters})
+        targets = dict(zip(shorts, self._get_targets(keys=[URL_GENERATION, URL_TABLE.format("")], args=shorts)))
+
+        self._statistics_store.write(counters, targets, uniques)
 
     def get_url_list(self) -> List[Tuple[str, List[str]]]:
         """
@@ -212,109 +1127,227 @@ class SimpleShortener:
         :return: returns a list of the available url and their shorts
         :rtype: List[Tuple[str, List[str]]]
         """
-        data = []
+        return list(self._statistics_store.get_shorts(self._statistics_store.get_targets()).items())
 
-        for v in self._redis_statistics.keys(STATISTICS_TARGET_ALL):
-            data.append((v[len(STATISTICS_TARGET_ROOT):], list(self._redis_statistics.smembers(v))))
+    def export_statistics(self, since: Optional[str] = None) -> Iterator[List[dict]]:
+        """
+        Iterates in chunks over the statistics of every short, a record for each counter of each day
+        The statistics are read lazily with SCAN, so the memory doesn't grow with the number of shorts
+
+        :param since: the first date in "%Y-%m-%d" format, defaults to the oldest date kept
+        :type since: Optional[str]
+        :raises InvalidMetricsQuery: if the date is invalid
+        :return: chunks of records with short, target, date, kind ("total", "user-agent" or "browser"), name and count
+        :rtype: Iterator[List[dict]]
+        """
+        first, _ = self._metrics_period(since, None, "day")
 
-        return data
+        return self._statistics_store.export(
+            first.strftime("%Y-%m-%d"),
+            lambda shorts: self._get_targets(keys=[URL_GENERATION, URL_TABLE.format("")], args=shorts))
 
-    def get_metrics(self, url: str):
+    @timed("get_metrics")
+    def get_metrics(self, url: str, start: Optional[str] = None, end: Optional[str] = None,
+                    granularity: str = "day", breakdown: bool = True):
         """
         Returns complex struct includes the metrics for the url
+        The result is cached for a few seconds to serve the dashboards that poll it
 
         :param url: a target url or a short url
         :type url: str
+        :param start: the first date in "%Y-%m-%d" format, defaults to the oldest date kept
+        :type start: Optional[str]
+        :param end: the last date in "%Y-%m-%d" format, defaults to today
+        :type end: Optional[str]
+        :param granularity: "day", "week" or "month", the counters of each date are summed in its period
+        :type granularity: str
+        :param breakdown: if False the metrics of the shorts of a target are left out
+        :type breakdown: bool
+        :raises InvalidMetricsQuery: if the dates or the granularity are invalid
+        """
+        first, last = self._metrics_period(start, end, granularity)
+
+        key = "\0".join([url, str(first), str(last), granularity, str(breakdown)])
+        data = self._metrics_cache.get(key)
+
+        if data is None:
+            data = self._get_metrics(url, first, last, granularity, breakdown)
+            self._metrics_cache.put(key, data)
+
+        return data
+
+    def _metrics_period(self, start: Optional[str], end: Optional[str], granularity: str) -> Tuple[date, date]:
+        """
+        Validates the period of a metrics query and clamps it to the dates kept
+
+        :return: the first and the last date
+        :rtype: Tuple[date, date]
+        """
+        if granularity not in _METRICS_GRANULARITIES:
+            raise InvalidMetricsQuery("Invalid granularity \"{}\"".format(granularity))
+
+        # The default period is as long as the statistics expiration, today included
+        today = date.today()
+        oldest = today - self._statistics_expiration + timedelta(days=1)
+
+        try:
+            first = max(date.fromisoformat(start), oldest) if start else oldest
+            last = min(date.fromisoformat(end), today) if end else today
+
+        except (TypeError, ValueError):
+            raise InvalidMetricsQuery("Invalid date")
+
+        if first > last:
+            raise InvalidMetricsQuery("The start is after the end")
+
+        return first, last
+
+    @timed("get_bulk_metrics")
+    def get_bulk_metrics(self, urls: Union[str, List[str]], start: Optional[str] = None, end: Optional[str] = None,
+                         granularity: str = "day", breakdown: bool = False):
+        """
+        Returns the metrics of many urls read with a fixed number of round trips, whatever the number of urls
+        The result is cached for a few seconds as the one of get_metrics
+
+        :param urls: a list of target urls and short urls, or "all" for every target
+        :type urls: Union[str, List[str]]
+        :param start: the first date in "%Y-%m-%d" format, defaults to the oldest date kept
+        :type start: Optional[str]
+        :param end: the last date in "%Y-%m-%d" format, defaults to today
+        :type end: Optional[str]
+        :param granularity: "day", "week" or "month", the counters of each date are summed in its period
+        :type granularity: str
+        :param breakdown: if True the metrics of the shorts of each target are added
+        :type breakdown: bool
+        :raises InvalidMetricsQuery: if the urls, the dates or the granularity are invalid
+        """
+        if urls != "all" and (not isinstance(urls, list) or not all(isinstance(u, str) for u in urls)):
+            raise InvalidMetricsQuery("The urls must be a list of urls or \"all\"")
+
+        first, last = self._metrics_period(start, end, granularity)
+
+        key = "\0".join(["bulk", str(first), str(last), granularity, str(breakdown)] +
+                         (["all"] if urls == "all" else ["url:" + u for u in urls]))
+        data = self._metrics_cache.get(key)
+
+        if data is None:
+            urls = self._statistics_store.get_targets() if urls == "all" else list(dict.fromkeys(urls))
+            data = self._get_bulk_metrics(urls, first, last, granularity, breakdown)
+            self._metrics_cache.put(key, data)
+
+        return data
+
+    def _get_metrics(self, url: str, first: date, last: date, granularity: str, breakdown: bool):
+        data = self._get_bulk_metrics([url], first, last, granularity, breakdown)
+
+        return dict({"period": data["period"]}, **data["url"][0])
+
+    def _get_bulk_metrics(self, urls: List[str], first: date, last: date, granularity: str, breakdown: bool):
+        """
+        Reads the metrics of the urls with one pipeline for the shorts of the targets,
+        one for the rollups, one for the hashes of the shorts and one for each kind of uniques
         """
         data = {
             "period": {
-                "start": None,
-                "end": None,
-                "length": None
-            }
+                "start": first.strftime("%Y-%m-%d"),
+                "end": last.strftime("%Y-%m-%d"),
+                "length": (last - first).days + 1,
+                "granularity": granularity
+            },
+            "url": []
         }
 
-        # Sets the period of the data
-        data["period"]["start"] = (date.today() - self._statistics_expiration).strftime("%Y-%m-%d")
-        data["period"]["end"] = date.today().strftime("%Y-%m-%d")
-        data["period"]["length"] = self._statistics_expiration.days
+        # Maps each date of the period to the date that labels its day, week or month
+        buckets = {}
+        for i in range((last - first).days + 1):
+            d = first + timedelta(days=i)
 
-        # Checks if the url is not a target url
-        if not self._redis_statistics.exists(STATISTICS_TARGET.format(url)):
-            # Returns metrics of the short url
-            return dict(data, **(self._get_metrics_short(url)))
+            if granularity == "week":
+                bucket = d - timedelta(days=d.weekday())
+            elif granularity == "month":
+                bucket = d.replace(day=1)
+            else:
+                bucket = d
 
-        # Prepares the struct
-        data = dict(data, **{
-            "url": url,
-            "total": 0,
-            "per-day": None,
-            "user-agent": {},
-            "date": {},
-            "short": []
-        })
-
-        # For each short for the target url
-        for s in self._redis_statistics.smembers(STATISTICS_TARGET.format(url)):
-            # Gets the short metrics
-            short_data = self._get_metrics_short(s)
-            # Adds them to the list of the shorts metrics
-            data["short"].append(short_data)
-
-            # Updates total target
-            data["total"] += short_data["total"]
-            # Updates user agent target
-            data["user-agent"] = dict(Counter(data["user-agent"]) + Counter(short_data["user-agent"]))
-
-            # For each date for the short
-            for d in short_data["date"]:
-                # If there isn't yet, creates it for the target
-                if d not in data["date"]:
-                    data["date"][d] = {
-                        "total": 0,
-                        "user-agent": {}
-                    }
-                # Updates total for current date
-                data["date"][d]["total"] += short_data["date"][d]["total"]
-                # Updates user agent for current date
-                data["date"][d]["user-agent"] = dict(Counter(data["date"][d]["user-agent"])
-                                                     + Counter(short_data["date"][d]["user-agent"]))
-
-        data["per-day"] = data["total"] / self._statistics_expiration.days
+            buckets[d.strftime("%Y-%m-%d")] = bucket.strftime("%Y-%m-%d")
+
+        # The dates of each bucket, to count the unique visitors
+        dates = {}
+        for d, bucket in buckets.items():
+            dates.setdefault(bucket, []).append(d)
+
+        # The fields older than the statistics expiration are removed while they are read
+        oldest = (date.today() - self._statistics_expiration).strftime("%Y-%m-%d")
+
+        # The urls without shorts are not target urls, so they are read as short urls
+        shorts = self._statistics_store.get_shorts(urls)
+        targets = [u for u in urls if shorts[u]]
+
+        read = [u for u in urls if not shorts[u]]
+        if breakdown:
+            read = list(dict.fromkeys(read + [s for t in targets for s in shorts[t]]))
+
+        rollups = self._statistics_store.read_rollups(targets, oldest)
+        rollup_uniques = self._statistics_store.read_uniques(targets, dates, rollup=True)
+        fields = self._statistics_store.read(read, oldest)
+        uniques = self._statistics_store.read_uniques(read, dates)
+
+        for url in urls:
+            # Checks if the url is not a target url
+            if not shorts[url]:
+                data["url"].append(self._metrics_from_fields(url, fields[url], uniques[url], buckets))
+                continue
+
+            metrics = self._metrics_from_fields(url, rollups[url], rollup_uniques[url], buckets)
+
+            # Adds the metrics of each short
+            if breakdown:
+                metrics["short"] = [self._metrics_from_fields(s, fields[s], uniques[s], buckets)
+                                    for s in shorts[url]]
+
+            data["url"].append(metrics)
 
         return data
 
-    def _get_metrics_short(self, url: str):
+    def _metrics_from_fields(self, url: str, fields: Dict[str, int], uniques: dict, buckets: Dict[str, str]):
         data = {
             "url": url,
             "total": 0,
+            "uniques": uniques["total"],
             "per-day": None,
             "user-agent": {},
+            "browser": {},
             "date": {},
         }
-        string_begin, string_end = STATISTICS_DATE_TOTAL.format(short=url, date="{date}").split("{date}")
 
-        total = 0
+        for field, v in fields.items():
+            d, kind, *name = field.split(":", 2)
 
-        for k in self._redis_statistics.keys(STATISTICS_DATE_TOTAL.format(short=url, date="*")):
-            d = k[len(string_begin):-len(string_end)]
-            v = int(self._redis_statistics.get(k))
-            data["date"][d] = {
-                "total": v,
-                "user-agent": {}
-            }
-            total += v
+            # Skips the dates out of the period
+            if d not in buckets:
+                continue
 
-        data["total"] = total
-        data["per-day"] = total / self._statistics_expiration.days
+            d = buckets[d]
 
-        for d in data["date"]:
-            for k in self._redis_statistics.keys(STATISTICS_USERAGENT.format(short=url, date=d, user_agent="*")):
-                ua = k[len(STATISTICS_USERAGENT.format(short=url, date=d, user_agent="")):]
-                v = int(self._redis_statistics.get(k))
+            if d not in data["date"]:
+                data["date"][d] = {
+                    "total": 0,
+                    "uniques": uniques["date"].get(d, 0),
+                    "user-agent": {},
+                    "browser": {}
+                }
 
-                data["user-agent"][ua] = data["user-agent"].get(ua, 0) + v
+            if kind == "total":
+                data["date"][d]["total"] += v
+                data["total"] += v
+
+            else:
+                # Adds the user agent or browser bucket
+                name = name[0]
+                data[kind][name] = data[kind].get(name, 0) + v
+                data["date"][d][kind][name] = data["date"][d][kind].get(name, 0) + v
 
-                data["date"][d]["user-agent"][ua] = v
+        # Averages over the days of the period, both ends included
+        data["per-day"] = data["total"] / max(len(buckets), 1)
 
         return data
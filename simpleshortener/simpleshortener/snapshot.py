@@ -0,0 +1,197 @@
+import array
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterable, Iterator, Optional, Tuple
+
+# Header of the snapshot: magic, generation, entries, slots, offset of the slots
+_HEADER = struct.Struct("<4sQQQQ")
+_MAGIC = b"SSUT"
+
+# Slot of the hash table: tag of the hash, offset of the record, 0 if the slot is empty
+_SLOT = struct.Struct("<IQ")
+
+# Record of an entry followed by the short and the target encoded in utf-8
+_RECORD = struct.Struct("<HI")
+
+
+def _hash(short: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(short, digest_size=8).digest(), "little")
+
+
+class UrlSnapshot:
+    """
+    Read-only view of a snapshot of a url table
+
+    The file is memory mapped, so all the processes of the host share the same pages,
+    and a lookup hashes the short and probes the open addressing table of the file.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: the path of the snapshot
+        :type path: str
+        :raises OSError: if the file can't be opened
+        :raises ValueError: if the file isn't a snapshot
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, self.generation, self.entries, self._slots, self._table = _HEADER.unpack_from(self._mmap)
+
+        except struct.error:
+            raise ValueError("Invalid snapshot")
+
+        if magic != _MAGIC or self._table + self._slots * _SLOT.size != len(self._mmap):
+            raise ValueError("Invalid snapshot")
+
+    def get(self, short: str) -> Optional[str]:
+        """
+        Returns the target of the short url
+
+        :param short: the short url
+        :type short: str
+        :return: the target url or None if the short isn't in the snapshot
+        :rtype: Optional[str]
+        """
+        data = self._mmap
+        key = short.encode("utf-8")
+        h = _hash(key)
+        tag = h >> 32
+        i = h % self._slots
+
+        while True:
+            t, offset = _SLOT.unpack_from(data, self._table + i * _SLOT.size)
+
+            if offset == 0:
+                return None
+
+            if t == tag:
+                short_length, target_length = _RECORD.unpack_from(data, offset)
+                start = offset + _RECORD.size
+
+                if data[start:start + short_length] == key:
+                    start += short_length
+                    return data[start:start + target_length].decode("utf-8")
+
+            i = (i + 1) % self._slots
+
+    def stats(self) -> dict:
+        """
+        Returns the size of the snapshot
+
+        :return: a dict with generation, entries and bytes
+        :rtype: dict
+        """
+        return {
+            "generation": self.generation,
+            "entries": self.entries,
+            "bytes": len(self._mmap)
+        }
+
+
+def open_snapshot(path: str) -> Optional[UrlSnapshot]:
+    """
+    Opens a snapshot of a url table
+
+    :param path: the path of the snapshot
+    :type path: str
+    :return: the snapshot or None if it is missing or invalid
+    :rtype: Optional[UrlSnapshot]
+    """
+    try:
+        return UrlSnapshot(path)
+
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(path: str, generation: int, entries: Iterable[Tuple[str, str]]) -> None:
+    """
+    Writes a snapshot of a url table and atomically replaces the previous one
+
+    The records are streamed in the file and only the hashes and the offsets are kept in memory,
+    then the hash table is sized for a load of one half and appended.
+
+    :param path: the path of the snapshot
+    :type path: str
+    :param generation: the generation of the url table
+    :type generation: int
+    :param entries: the shorts and their targets
+    :type entries: Iterable[Tuple[str, str]]
+    """
+    hashes = array.array("Q")
+    offsets = array.array("Q")
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".snapshot-")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(bytes(_HEADER.size))
+            offset = _HEADER.size
+
+            for short, target in entries:
+                short, target = short.encode("utf-8"), target.encode("utf-8")
+
+                hashes.append(_hash(short))
+                offsets.append(offset)
+
+                f.write(_RECORD.pack(len(short), len(target)))
+                f.write(short)
+                f.write(target)
+                offset += _RECORD.size + len(short) + len(target)
+
+            # An HSCAN can return a short twice, the duplicates are harmless since a lookup stops at the first one
+            slots = max(len(hashes) * 2, 8)
+            table = bytearray(slots * _SLOT.size)
+
+            for h, o in zip(hashes, offsets):
+                i = h % slots
+                while _SLOT.unpack_from(table, i * _SLOT.size)[1] != 0:
+                    i = (i + 1) % slots
+                _SLOT.pack_into(table, i * _SLOT.size, h >> 32, o)
+
+            f.write(table)
+
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, generation, len(hashes), slots, offset))
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def snapshot_lock(path: str) -> Iterator[bool]:
+    """
+    Tries to take the lock that lets only one process of the host write the snapshot
+
+    :param path: the path of the snapshot
+    :type path: str
+    :return: a context that yields True if the lock was taken
+    :rtype: Iterator[bool]
+    """
+    with open(path + ".lock", "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,794 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from redis import StrictRedis
+from redis.client import NEVER_DECODE, Pipeline
+
+from telemetry import STATISTICS_EVENTS, STATISTICS_QUEUE
+from .redis_key import *
+from .ring import HashRing
+from .timeseries import pack, unpack
+
+# Retrieves logger
+_logger = logging.getLogger(__package__)
+
+# Marks the end of the events in the queue
+_STOP = object()
+
+# Number of keys moved for each round trip of a rebalance
+_REBALANCE_BATCH = 1000
+
+# Number of hashes packed for each transaction of a compaction
+_COMPACTION_BATCH = 200
+
+# Number of hashes read for each round trip of an export
+_EXPORT_BATCH = 500
+
+# Keys of a short or of a target, they end with the name of the short or of the target
+_SHARDED_KEYS = [STATISTICS_HASH, STATISTICS_ROLLUP, STATISTICS_TARGET, STATISTICS_UNIQUE, STATISTICS_UNIQUE_ROLLUP,
+                 STATISTICS_PACKED.format(STATISTICS_HASH), STATISTICS_PACKED.format(STATISTICS_ROLLUP)]
+
+
+class StatisticsAggregator:
+    """
+    Collects the statistics events in memory and writes them in batch from a background thread
+
+    The events are counted in a Counter and handed to the flush callable every flush_interval
+    milliseconds or every flush_size events, whichever comes first.
+
+    Loss window: the events still in the queue or in the pending Counter are lost if the process
+    is killed without a graceful shutdown, so at most flush_interval milliseconds of clicks
+    (bounded by queue_size). If the queue is full the new events are dropped and counted.
+    On close the queue is drained and the last batch is flushed.
+    """
+
+    def __init__(self,
+                 flush: Callable[[Counter], None],
+                 flush_interval: int = 1000,
+                 flush_size: int = 1000,
+                 queue_size: int = 100000):
+        self._flush = flush
+        self._flush_interval = flush_interval / 1000
+        self._flush_size = flush_size
+
+        self._queue = queue.Queue(maxsize=queue_size)
+
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name="statistics-flusher", daemon=True)
+        self._thread.start()
+
+    def record(self, *event: Hashable) -> bool:
+        """
+        Queues an event without blocking
+
+        :param event: the values that identify the counter to increment
+        :return: False if the queue was full and the event was dropped
+        :rtype: bool
+        """
+        try:
+            self._queue.put_nowait(event)
+            return True
+
+        except queue.Full:
+            self.dropped += 1
+            STATISTICS_EVENTS.labels("dropped").inc()
+            return False
+
+    def close(self, timeout: float = 5) -> None:
+        """
+        Drains the queue, flushes the pending events and stops the background thread
+
+        :param timeout: max seconds to wait for the drain
+        :type timeout: float
+        """
+        if not self._thread.is_alive():
+            return
+
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+
+        except queue.Full:
+            _logger.warning("Statistics queue is still full, the pending events will be lost")
+            return
+
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the aggregator
+
+        :return: a dict with queued, dropped, flushed and failed events
+        :rtype: dict
+        """
+        return {
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed
+        }
+
+    def _run(self) -> None:
+        counts = Counter()
+        pending = 0
+        deadline = time.monotonic() + self._flush_interval
+
+        while True:
+            try:
+                event = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+
+            except queue.Empty:
+                event = None
+
+            if event is _STOP:
+                self._write(counts, pending)
+                return
+
+            if event is not None:
+                counts[event] += 1
+                pending += 1
+
+            if pending >= self._flush_size or time.monotonic() >= deadline:
+                self._write(counts, pending)
+
+                counts = Counter()
+                pending = 0
+                deadline = time.monotonic() + self._flush_interval
+
+    def _write(self, counts: Counter, pending: int) -> None:
+        STATISTICS_QUEUE.set(self._queue.qsize())
+
+        if pending == 0:
+            return
+
+        try:
+            self._flush(counts)
+            self.flushed += pending
+            STATISTICS_EVENTS.labels("flushed").inc(pending)
+
+        except Exception as e:
+            self.failed += pending
+            STATISTICS_EVENTS.labels("failed").inc(pending)
+            _logger.warning("Failed to write %s statistics events: %s", pending, e)
+
+
+class StatisticsStore:
+    """
+    Reads and writes the statistics db with the layout v3
+
+    Each short has a hash (STATISTICS_HASH) whose fields are the counters of the day
+    ("{date}:total" and "{date}:user-agent:{user_agent}"), each target has a set of its shorts
+    (STATISTICS_TARGET) and a rollup hash (STATISTICS_ROLLUP) with the sum of the counters of its shorts,
+    the targets are listed in a registry set (STATISTICS_TARGETS),
+    so every read costs a fixed number of round trips and no KEYS is needed.
+    The unique visitors of each day are HyperLogLogs (STATISTICS_UNIQUE and STATISTICS_UNIQUE_ROLLUP),
+    about 12 KB each at most whatever the traffic, and a period is counted by merging its days.
+    The counters of the closed days are moved by the compaction from the hashes into a packed
+    string (STATISTICS_PACKED) and the reads merge the two
+
+    The db can be split on many shards: the keys of a short live on the shard of the short and
+    the keys of a target, its registry entry included, on the shard of the target, placed by
+    consistent hashing, so the commands of a short or of a target never span two shards.
+    Each read or write runs one pipeline on each shard involved, in parallel.
+    """
+
+    def __init__(self, redis: Union[StrictRedis, List[StrictRedis]], expiration: timedelta,
+                 names: Optional[List[str]] = None):
+        """
+        :param redis: the statistics db or its shards
+        :type redis: Union[StrictRedis, List[StrictRedis]]
+        :param expiration: the expiration of the statistics
+        :type expiration: timedelta
+        :param names: the names of the shards that place them on the ring, e.g. their urls,
+            defaults to their position
+        :type names: Optional[List[str]]
+        """
+        self._shards = redis if isinstance(redis, list) else [redis]
+        self._expiration = expiration
+
+        self._ring = HashRing(names or [str(i) for i in range(len(self._shards))])
+
+        # A single shard is used from the calling thread
+        self._executor = ThreadPoolExecutor(max_workers=len(self._shards), thread_name_prefix="statistics-shard") \
+            if len(self._shards) > 1 else None
+
+    def close(self) -> None:
+        """
+        Stops the threads of the shards
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _pipeline(self, pipelines: Dict[int, Pipeline], name: str) -> Pipeline:
+        """
+        Returns the pipeline of the shard of the short or the target, it is created if it is missing
+        """
+        i = self._ring.node(name)
+
+        if i not in pipelines:
+            pipelines[i] = self._shards[i].pipeline(transaction=False)
+
+        return pipelines[i]
+
+    def _execute(self, pipelines: Dict[int, Pipeline]) -> Dict[int, list]:
+        """
+        Executes the pipelines of the shards in parallel
+
+        :return: the replies of the pipeline of each shard
+        :rtype: Dict[int, list]
+        """
+        if self._executor is None or len(pipelines) < 2:
+            return {i: p.execute() for i, p in pipelines.items()}
+
+        futures = {}
+        replies = {}
+
+        for i, p in pipelines.items():
+            try:
+                # The round trips keep the endpoint of the request in their metrics
+                futures[i] = self._executor.submit(contextvars.copy_context().run, p.execute)
+
+            except RuntimeError:
+                # The pool is shut down, e.g. by the interpreter exit before the last flush of the statistics,
+                # so the pipeline runs on the calling thread
+                replies[i] = p.execute()
+
+        replies.update((i, f.result()) for i, f in futures.items())
+
+        return replies
+
+    def _fan_out(self, names: List[str], queue: Callable[[Pipeline, str], None]) -> Dict[str, list]:
+        """
+        Queues the commands of each name in the pipeline of its shard and executes them
+
+        :param names: the shorts or the targets
+        :type names: List[str]
+        :param queue: queues the commands of a name in a pipeline
+        :type queue: Callable[[Pipeline, str], None]
+        :return: the replies of the commands of each name
+        :rtype: Dict[str, list]
+        """
+        pipelines = {}
+        spans = []
+
+        # Each name is hashed once, its shard is both the pipeline and the position of its replies
+        for i, group in self._ring.group(names).items():
+            p = pipelines[i] = self._shards[i].pipeline(transaction=False)
+
+            for name in group:
+                start = len(p)
+                queue(p, name)
+                spans.append((name, i, start, len(p)))
+
+        replies = self._execute(pipelines)
+
+        return {name: replies[i][start:end] for name, i, start, end in spans}
+
+    def write(self, counters: Counter, targets: Dict[str, str],
+              uniques: Optional[Dict[Tuple[str, str], Set[str]]] = None) -> None:
+        """
+        Increments the counters of the shorts and the rollups of their targets with a single pipeline for each shard
+
+        The rollup of a target is updated with the hits of the shorts that point to it when the hits
+        are written, so a short moved to another target leaves its past hits in the old rollup
+
+        :param counters: the increment for each (short, field)
+        :type counters: Counter
+        :param targets: the target of each short, the shorts without a target have no rollup
+        :type targets: Dict[str, str]
+        :param uniques: the fingerprints of the visitors for each (short, date)
+        :type uniques: Optional[Dict[Tuple[str, str], Set[str]]]
+        """
+        pipelines = {}
+        keys = {}
+
+        def add(name: str, key: str) -> Pipeline:
+            keys[key] = name
+            return self._pipeline(pipelines, name)
+
+        for (short, field), n in counters.items():
+            add(short, STATISTICS_HASH.format(short)).hincrby(STATISTICS_HASH.format(short), field, n)
+
+            if targets.get(short) is not None:
+                key = STATISTICS_ROLLUP.format(targets[short])
+                add(targets[short], key).hincrby(key, field, n)
+
+        for (short, d), fingerprints in (uniques or {}).items():
+            key = STATISTICS_UNIQUE.format(short, date=d)
+            add(short, key).pfadd(key, *fingerprints)
+
+            if targets.get(short) is not None:
+                key = STATISTICS_UNIQUE_ROLLUP.format(targets[short], date=d)
+                add(targets[short], key).pfadd(key, *fingerprints)
+
+        # Keeps alive only the hashes still used
+        for key, name in keys.items():
+            self._pipeline(pipelines, name).expire(key, self._expiration)
+
+        self._execute(pipelines)
+
+    def read(self, shorts: Iterable[str], start: str) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the counters of the shorts since the start date with a single pipeline for each shard
+        The fields older than the start date are removed
+
+        :param shorts: the shorts to read
+        :type shorts: Iterable[str]
+        :param start: the first date to keep in "%Y-%m-%d" format
+        :type start: str
+        :return: the counters for each short
+        :rtype: Dict[str, Dict[str, int]]
+        """
+        return self._read(STATISTICS_HASH, shorts, start)
+
+    def read_rollups(self, targets: Iterable[str], start: str) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the counters of the targets since the start date with a single pipeline for each shard
+        The fields older than the start date are removed
+
+        :param targets: the targets to read
+        :type targets: Iterable[str]
+        :param start: the first date to keep in "%Y-%m-%d" format
+        :type start: str
+        :return: the counters for each target
+        :rtype: Dict[str, Dict[str, int]]
+        """
+        return self._read(STATISTICS_ROLLUP, targets, start)
+
+    def read_uniques(self, names: Iterable[str], dates: Dict[str, List[str]],
+                     rollup: bool = False) -> Dict[str, dict]:
+        """
+        Returns the unique visitors of the shorts or of the targets with a single pipeline for each shard
+
+        The visitors of a group of dates and of the whole period are counted by PFCOUNT on
+        the HyperLogLogs of their days, that merges them without writing a key
+
+        :param names: the shorts or the targets to read
+        :type names: Iterable[str]
+        :param dates: the dates in "%Y-%m-%d" format of each group, e.g. of each week
+        :type dates: Dict[str, List[str]]
+        :param rollup: True if the names are targets
+        :type rollup: bool
+        :return: for each name a dict with the "total" of the period and the visitors of each group in "date"
+        :rtype: Dict[str, dict]
+        """
+        key = STATISTICS_UNIQUE_ROLLUP if rollup else STATISTICS_UNIQUE
+
+        def queue(p: Pipeline, name: str):
+            for group in dates.values():
+                p.pfcount(*[key.format(name, date=d) for d in group])
+            p.pfcount(*[key.format(name, date=d) for group in dates.values() for d in group])
+
+        return {name: {"total": values[-1], "date": {g: n for g, n in zip(dates, values) if n}}
+                for name, values in self._fan_out(list(names), queue).items()}
+
+    def _read(self, key: str, names: Iterable[str], start: str) -> Dict[str, Dict[str, int]]:
+        def queue(p: Pipeline, name: str):
+            p.hgetall(key.format(name))
+            p.execute_command("GET", STATISTICS_PACKED.format(key.format(name)), **{NEVER_DECODE: []})
+
+        replies = self._fan_out(list(names), queue)
+
+        data = {}
+        expired = {}
+
+        for name, (fields, packed) in replies.items():
+            data[name] = {}
+
+            if packed:
+                try:
+                    data[name] = unpack(packed, start)
+
+                except ValueError:
+                    # The live counters of the hash are still returned
+                    _logger.warning("Invalid packed counters of %s", key.format(name))
+
+            for field, v in fields.items():
+                # The fields start with the date, so they can be compared as strings
+                if field < start:
+                    expired.setdefault(name, []).append(field)
+                else:
+                    data[name][field] = data[name].get(field, 0) + int(v)
+
+        if expired:
+            pipelines = {}
+            for name, fields in expired.items():
+                self._pipeline(pipelines, name).hdel(key.format(name), *fields)
+            self._execute(pipelines)
+
+        return data
+
+    def export(self, start: str, lookup: Callable[[List[str]], List[Optional[str]]]) -> Iterator[List[dict]]:
+        """
+        Iterates in chunks over the counters of every short since the start date, a record for each counter of each day
+
+        The hashes and then the packed counters are walked with SCAN on one shard at a time and read
+        with one pipeline for each chunk, so the memory is bounded by the chunk and the db is never blocked.
+        The days packed while the export runs, or hit after they were packed, can be split in two records,
+        their counts are summed.
+
+        :param start: the first date to export in "%Y-%m-%d" format
+        :type start: str
+        :param lookup: returns the current target of each short
+        :type lookup: Callable[[List[str]], List[Optional[str]]]
+        :return: chunks of records with short, target, date, kind ("total", "user-agent" or "browser"), name and count
+        :rtype: Iterator[List[dict]]
+        """
+        for shard in self._shards:
+            for key in (STATISTICS_HASH, STATISTICS_PACKED.format(STATISTICS_HASH)):
+                prefix = len(key.format(""))
+                cursor = None
+
+                while cursor != 0:
+                    cursor, keys = shard.scan(cursor or 0, match=key.format("*"), count=_EXPORT_BATCH)
+
+                    if not keys:
+                        continue
+
+                    p = shard.pipeline(transaction=False)
+                    for k in keys:
+                        if key == STATISTICS_HASH:
+                            p.hgetall(k)
+                        else:
+                            p.execute_command("GET", k, **{NEVER_DECODE: []})
+
+                    shorts = [k[prefix:] for k in keys]
+                    records = []
+
+                    for short, target, fields in zip(shorts, lookup(shorts), p.execute()):
+                        if not fields:
+                            continue
+
+                        if key != STATISTICS_HASH:
+                            try:
+                                fields = unpack(fields, start)
+
+                            except ValueError:
+                                _logger.warning("Invalid packed counters of %s, not exported", short)
+                                continue
+
+                        for field, v in fields.items():
+                            # The fields start with the date, so they can be compared as strings
+                            if field < start:
+                                continue
+
+                            d, kind, *name = field.split(":", 2)
+
+                            records.append({
+                                "short": short,
+                                "target": target,
+                                "date": d,
+                                "kind": kind,
+                                "name": name[0] if name else None,
+                                "count": int(v)
+                            })
+
+                    if records:
+                        yield records
+
+    def get_targets(self) -> List[str]:
+        """
+        Returns the list of the targets, each shard has the registry of its targets
+
+        :return: the registered targets
+        :rtype: List[str]
+        """
+        pipelines = {i: shard.pipeline(transaction=False).smembers(STATISTICS_TARGETS)
+                     for i, shard in enumerate(self._shards)}
+
+        return [t for (targets,) in self._execute(pipelines).values() for t in targets]
+
+    def get_shorts(self, targets: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Returns the shorts of the targets with a single pipeline for each shard
+
+        :param targets: the target urls
+        :type targets: Iterable[str]
+        :return: the shorts for each target
+        :rtype: Dict[str, List[str]]
+        """
+        replies = self._fan_out(list(targets), lambda p, t: p.smembers(STATISTICS_TARGET.format(t)))
+
+        return {t: list(s) for t, (s,) in replies.items()}
+
+    def update_targets(self, changes: Iterable[List[Tuple[str, Optional[str], Optional[str]]]]) -> None:
+        """
+        Moves the shorts between the sets of the targets, one pipeline for each shard for each chunk of changes
+        The targets left without shorts are removed from the registry
+
+        :param changes: chunks of (short, old target, new target), a target is None if the short is missing
+        :type changes: Iterable[List[Tuple[str, Optional[str], Optional[str]]]]
+        """
+        emptied = set()
+
+        for chunk in changes:
+            if not chunk:
+                continue
+
+            removed = {}
+            added = {}
+
+            for short, old, new in chunk:
+                if old is not None:
+                    removed.setdefault(old, []).append(short)
+                if new is not None:
+                    added.setdefault(new, []).append(short)
+
+            pipelines = {}
+
+            for t, shorts in removed.items():
+                self._pipeline(pipelines, t).srem(STATISTICS_TARGET.format(t), *shorts)
+            for t, shorts in added.items():
+                self._pipeline(pipelines, t).sadd(STATISTICS_TARGET.format(t), *shorts).sadd(STATISTICS_TARGETS, t)
+
+            self._execute(pipelines)
+
+            emptied.update(removed)
+
+        self._prune_targets(emptied)
+
+    def reconcile_targets(self, lookup: Callable[[List[str]], List[Optional[str]]]) -> None:
+        """
+        Removes from the sets of the targets the shorts that point somewhere else
+
+        :param lookup: returns the current target of each short
+        :type lookup: Callable[[List[str]], List[Optional[str]]]
+        """
+        targets = self.get_targets()
+
+        for target, shorts in self.get_shorts(targets).items():
+            stale = [s for s, t in zip(shorts, lookup(shorts) if shorts else []) if t != target]
+
+            if stale:
+                self._shards[self._ring.node(target)].srem(STATISTICS_TARGET.format(target), *stale)
+
+        self._prune_targets(targets)
+
+    def _prune_targets(self, targets: Iterable[str]) -> None:
+        replies = self._fan_out(list(targets), lambda p, t: p.scard(STATISTICS_TARGET.format(t)))
+
+        pipelines = {}
+        for t, (n,) in replies.items():
+            if n == 0:
+                self._pipeline(pipelines, t).srem(STATISTICS_TARGETS, t)
+
+        self._execute(pipelines)
+
+    def compact(self, before: str, oldest: str) -> int:
+        """
+        Packs the counters of the days before a date, once for each date, and trims the packed counters
+        older than the statistics expiration
+
+        The fields of a hash are removed in the same transaction that writes the packed counters,
+        so a read sees them either in the hash or in the packed string.
+        The days compacted must be closed, a hit written on them while they are packed would be lost.
+        Only one process at a time compacts a shard, the others skip it.
+
+        :param before: the first date that is not packed in "%Y-%m-%d" format
+        :type before: str
+        :param oldest: the first date to keep in "%Y-%m-%d" format
+        :type oldest: str
+        :return: the number of hashes packed
+        :rtype: int
+        """
+        compacted = 0
+
+        for shard in self._shards:
+            if (shard.get(STATISTICS_COMPACTED) or "") >= before:
+                continue
+
+            if not shard.set(STATISTICS_COMPACTION_LOCK, before, nx=True, ex=3600):
+                _logger.info("Statistics compaction is running in another process")
+                continue
+
+            try:
+                for key in (STATISTICS_HASH, STATISTICS_ROLLUP):
+                    batch = []
+
+                    for k in shard.scan_iter(key.format("*"), count=_COMPACTION_BATCH):
+                        batch.append(k)
+
+                        if len(batch) >= _COMPACTION_BATCH:
+                            compacted += self._compact(shard, batch, before, oldest)
+                            batch = []
+
+                    if batch:
+                        compacted += self._compact(shard, batch, before, oldest)
+
+                shard.set(STATISTICS_COMPACTED, before)
+
+            finally:
+                shard.delete(STATISTICS_COMPACTION_LOCK)
+
+        return compacted
+
+    def _compact(self, shard: StrictRedis, keys: List[str], before: str, oldest: str) -> int:
+        """
+        Moves the fields of the closed days of the hashes in their packed counters
+
+        :return: the number of hashes packed
+        :rtype: int
+        """
+        p = shard.pipeline(transaction=False)
+        for k in keys:
+            p.hgetall(k)
+            p.execute_command("GET", STATISTICS_PACKED.format(k), **{NEVER_DECODE: []})
+        replies = p.execute()
+
+        p = shard.pipeline(transaction=True)
+        compacted = 0
+
+        for k, fields, packed in zip(keys, replies[::2], replies[1::2]):
+            closed = [f for f in fields if f < before]
+
+            try:
+                counters = unpack(packed) if packed else {}
+
+            except ValueError:
+                _logger.warning("Dropped the invalid packed counters of %s", k)
+                counters = {}
+
+            # Skips the hashes without closed days and whose packed counters are still all kept
+            if not closed and all(f >= oldest for f in counters):
+                continue
+
+            for f in closed:
+                counters[f] = counters.get(f, 0) + int(fields[f])
+
+            counters = {f: v for f, v in counters.items() if f >= oldest}
+
+            if counters:
+                p.set(STATISTICS_PACKED.format(k), pack(counters), ex=self._expiration)
+            else:
+                p.delete(STATISTICS_PACKED.format(k))
+
+            if closed:
+                p.hdel(k, *closed)
+
+            compacted += 1
+
+        p.execute()
+
+        return compacted
+
+    def rebalance(self) -> None:
+        """
+        Moves the keys to their shard if the shards changed since the last rebalance
+
+        The keys are merged in the ones already written on their new shard, then deleted from the old one,
+        so the hits of a key moved while the rebalance is interrupted can be counted twice.
+        Only one process at a time runs the rebalance, the others serve the keys already moved.
+        """
+        replies = self._execute({i: shard.pipeline(transaction=False).get(STATISTICS_SHARDS)
+                                 for i, shard in enumerate(self._shards)})
+
+        if all(signature == self._ring.signature for (signature,) in replies.values()):
+            return
+
+        lock = self._shards[0]
+
+        if not lock.set(STATISTICS_REBALANCE_LOCK, self._ring.signature, nx=True, ex=3600):
+            _logger.info("Statistics rebalance is running in another process")
+            return
+
+        try:
+            # A single shard owns all the keys
+            if len(self._shards) > 1:
+                _logger.info("Rebalancing the statistics on %s shards...", len(self._shards))
+
+                moved = sum(self._rebalance_shard(i) for i in range(len(self._shards)))
+
+                _logger.info("Moved %s statistics keys", moved)
+
+            for shard in self._shards:
+                shard.set(STATISTICS_SHARDS, self._ring.signature)
+
+        finally:
+            lock.delete(STATISTICS_REBALANCE_LOCK)
+
+    def _rebalance_shard(self, i: int) -> int:
+        """
+        Moves the keys of the shard that belong to another shard
+
+        :return: the number of moved keys
+        :rtype: int
+        """
+        shard = self._shards[i]
+        moved = 0
+
+        # Moves the registry entries with their targets
+        targets = [t for t in shard.smembers(STATISTICS_TARGETS) if self._ring.node(t) != i]
+        if targets:
+            pipelines = {}
+            for t in targets:
+                self._pipeline(pipelines, t).sadd(STATISTICS_TARGETS, t)
+            self._execute(pipelines)
+
+            shard.srem(STATISTICS_TARGETS, *targets)
+
+        for key in _SHARDED_KEYS:
+            prefix = len(key.format("", date="YYYY-MM-DD"))
+            batch = []
+
+            for k in shard.scan_iter(key.format("*", date="*"), count=_REBALANCE_BATCH):
+                name = k[prefix:]
+
+                if self._ring.node(name) != i:
+                    batch.append((k, name))
+
+                if len(batch) >= _REBALANCE_BATCH:
+                    moved += self._move(shard, key, batch)
+                    batch = []
+
+            if batch:
+                moved += self._move(shard, key, batch)
+
+        return moved
+
+    def _move(self, shard: StrictRedis, key: str, batch: List[Tuple[str, str]]) -> int:
+        """
+        Merges the keys of a kind in their shards and deletes them from the old one
+
+        :return: the number of moved keys
+        :rtype: int
+        """
+        p = shard.pipeline(transaction=False)
+        for k, _ in batch:
+            if key == STATISTICS_TARGET:
+                p.smembers(k)
+            elif key in (STATISTICS_UNIQUE, STATISTICS_UNIQUE_ROLLUP):
+                p.dump(k)
+            elif key.startswith(STATISTICS_PACKED.format("")):
+                p.execute_command("GET", k, **{NEVER_DECODE: []})
+            else:
+                p.hgetall(k)
+
+        pipelines = {}
+
+        for (k, name), value in zip(batch, p.execute()):
+            if not value:
+                continue
+
+            p = self._pipeline(pipelines, name)
+
+            if key == STATISTICS_TARGET:
+                p.sadd(k, *value)
+                continue
+
+            if key in (STATISTICS_UNIQUE, STATISTICS_UNIQUE_ROLLUP):
+                # The HyperLogLog is restored beside the one of the new shard and merged in it
+                p.restore(STATISTICS_REBALANCE_TMP.format(k), 0, value, replace=True)
+                p.pfmerge(k, STATISTICS_REBALANCE_TMP.format(k))
+                p.delete(STATISTICS_REBALANCE_TMP.format(k))
+            elif key.startswith(STATISTICS_PACKED.format("")):
+                # The packed counters are unpacked in the hash of the new shard, the next compaction packs them again
+                try:
+                    counters = unpack(value)
+
+                except ValueError:
+                    _logger.warning("Dropped the invalid packed counters of %s", k)
+                    counters = {}
+
+                k = k[len(STATISTICS_PACKED.format("")):]
+                for field, v in counters.items():
+                    p.hincrby(k, field, v)
+            else:
+                for field, v in value.items():
+                    p.hincrby(k, field, int(v))
+
+            p.expire(k, self._expiration)
+
+        self._execute(pipelines)
+
+        shard.delete(*[k for k, _ in batch])
+
+        return len(batch)
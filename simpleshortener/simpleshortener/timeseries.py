@@ -0,0 +1,94 @@
+import struct
+from datetime import date
+from typing import Dict
+
+# Header of the packed counters: magic, first day as ordinal, days, columns
+_HEADER = struct.Struct("<4sIHH")
+_MAGIC = b"SSTS"
+
+# Length of the name of a column
+_NAME = struct.Struct("<B")
+
+
+def pack(fields: Dict[str, int]) -> bytes:
+    """
+    Packs the counters of a short in a matrix of fixed width integers, a row for each day
+
+    The columns are the kinds of counter ("total", "user-agent:{user_agent}", ...) named once in the header,
+    so a day costs 4 bytes for each column instead of a hash field with its name and its date.
+
+    :param fields: the counters as the fields of the statistics hashes, "{date}:{column}"
+    :type fields: Dict[str, int]
+    :return: the packed counters
+    :rtype: bytes
+    """
+    days = {}
+    columns = {}
+
+    for field, v in fields.items():
+        d, column = field.split(":", 1)
+        days.setdefault(date.fromisoformat(d).toordinal(), {})[column] = v
+        columns.setdefault(column, len(columns))
+
+    if not days:
+        return _HEADER.pack(_MAGIC, 0, 0, 0)
+
+    first = min(days)
+    length = max(days) - first + 1
+
+    matrix = [0] * (length * len(columns))
+    for d, values in days.items():
+        for column, v in values.items():
+            matrix[(d - first) * len(columns) + columns[column]] = v
+
+    names = b"".join(_NAME.pack(len(c.encode("utf-8"))) + c.encode("utf-8") for c in columns)
+
+    return _HEADER.pack(_MAGIC, first, length, len(columns)) + names + struct.pack("<{}I".format(len(matrix)),
+                                                                                    *matrix)
+
+
+def unpack(data: bytes, start: str = "") -> Dict[str, int]:
+    """
+    Unpacks the counters packed by pack
+
+    :param data: the packed counters
+    :type data: bytes
+    :param start: the first date to return in "%Y-%m-%d" format
+    :type start: str
+    :raises ValueError: if the data isn't packed counters
+    :return: the counters not null as the fields of the statistics hashes
+    :rtype: Dict[str, int]
+    """
+    try:
+        magic, first, length, width = _HEADER.unpack_from(data)
+
+        offset = _HEADER.size
+        columns = []
+
+        for _ in range(width):
+            (n,) = _NAME.unpack_from(data, offset)
+            columns.append(data[offset + _NAME.size:offset + _NAME.size + n].decode("utf-8"))
+            offset += _NAME.size + n
+
+        matrix = struct.unpack_from("<{}I".format(length * width), data, offset)
+
+    except (struct.error, UnicodeDecodeError):
+        raise ValueError("Invalid packed counters")
+
+    if magic != _MAGIC:
+        raise ValueError("Invalid packed counters")
+
+    fields = {}
+
+    for i in range(length):
+        d = date.fromordinal(first + i).strftime("%Y-%m-%d")
+
+        # The dates are sorted, so the ones before the start are skipped
+        if d < start:
+            continue
+
+        for j, column in enumerate(columns):
+            if matrix[i * width + j]:
+                fields["{}:{}".format(d, column)] = matrix[i * width + j]
+
+    return fields
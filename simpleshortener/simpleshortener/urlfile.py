@@ -0,0 +1,122 @@
+import functools
+import io
+import json
+from typing import BinaryIO, Iterator
+
+from .exceptions import *
+
+# Number of characters read for each step of the parser
+_CHUNK = 65536
+
+
+@functools.lru_cache(maxsize=None)
+def _entry_schema():
+    """Returns the schema of each entry of the url file, schema is imported at the first sync"""
+    from schema import Schema
+
+    return Schema({
+        "target": str,
+        "short": [str]
+    })
+
+
+def iter_url_file(f: BinaryIO, chunk: int = _CHUNK) -> Iterator[dict]:
+    """
+    Parses the url file incrementally and yields its entries one by one after validating them
+    Only one chunk of the file and one entry are kept in memory at a time
+
+    :param f: the url file opened in binary mode
+    :type f: BinaryIO
+    :param chunk: number of characters read at once
+    :type chunk: int
+    :raises UrlFileInvalidJSON: if the file was invalid JSON
+    :raises UrlFileInvalidSchema: if an entry didn't have the right scheme
+    :return: an iterator over the entries
+    :rtype: Iterator[dict]
+    """
+    from schema import SchemaError
+
+    schema = _entry_schema()
+
+    for entry in _iter_json_array(io.TextIOWrapper(f, encoding="utf-8"), chunk):
+        try:
+            yield schema.validate(entry)
+
+        except SchemaError:
+            raise UrlFileInvalidSchema
+
+
+def _iter_json_array(f: io.TextIOBase, chunk: int) -> Iterator:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def next_char():
+        """Skips the whitespaces and returns the next char without consuming it, None at the end of the file"""
+        nonlocal buffer, pos, eof
+
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+
+            if pos < len(buffer):
+                return buffer[pos]
+
+            if eof:
+                return None
+
+            buffer = f.read(chunk)
+            pos = 0
+            eof = buffer == ""
+
+    try:
+        if next_char() != "[":
+            raise UrlFileInvalidJSON
+
+        pos += 1
+
+        if next_char() == "]":
+            pos += 1
+
+        else:
+            while True:
+                if next_char() is None:
+                    raise UrlFileInvalidJSON
+
+                # Decodes the next value reading more of the file until it is complete
+                while True:
+                    try:
+                        value, end = decoder.raw_decode(buffer, pos)
+
+                        # A value touching the end of the buffer could be truncated
+                        if end < len(buffer) or eof:
+                            break
+
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise UrlFileInvalidJSON
+
+                    more = f.read(chunk)
+                    buffer = buffer[pos:] + more
+                    pos = 0
+                    eof = more == ""
+
+                pos = end
+                yield value
+
+                c = next_char()
+
+                if c == ",":
+                    pos += 1
+                elif c == "]":
+                    pos += 1
+                    break
+                else:
+                    raise UrlFileInvalidJSON
+
+        if next_char() is not None:
+            raise UrlFileInvalidJSON
+
+    except UnicodeDecodeError:
+        raise UrlFileInvalidJSON
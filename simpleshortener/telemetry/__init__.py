@@ -0,0 +1,138 @@
+__all__ = ["ENDPOINT", "LATENCY", "REDIS_ROUNDTRIPS", "SYNC_ENTRIES", "SYNC_LAST_SUCCESS", "CACHE_REQUESTS", "CACHE_SIZE",
+           "URL_FILTER_BYTES", "STATISTICS_QUEUE", "STATISTICS_EVENTS", "LOG_DROPPED", "InstrumentedRedis", "timed",
+           "exposition", "CONTENT_TYPE"]
+
+import contextvars
+import functools
+import os
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST as CONTENT_TYPE
+from redis import StrictRedis
+from redis.client import Pipeline
+
+# The metrics are aggregated across the worker processes if PROMETHEUS_MULTIPROC_DIR is set
+_MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Name of the endpoint served by the current thread or task, used to label the redis round trips
+ENDPOINT = contextvars.ContextVar("endpoint", default="background")
+
+_LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+
+LATENCY = Histogram("simpleshortener_latency_seconds",
+                    "Latency of the operations of the service",
+                    ["operation"], buckets=_LATENCY_BUCKETS)
+
+REDIS_ROUNDTRIPS = Histogram("simpleshortener_redis_roundtrip_seconds",
+                             "Latency of the redis round trips for each endpoint",
+                             ["endpoint", "db"], buckets=_LATENCY_BUCKETS)
+
+SYNC_ENTRIES = Gauge("simpleshortener_sync_entries",
+                     "Number of shorts loaded by the last sync",
+                     multiprocess_mode="mostrecent")
+
+SYNC_LAST_SUCCESS = Gauge("simpleshortener_sync_last_success_timestamp_seconds",
+                          "Time of the last successful sync",
+                          multiprocess_mode="max")
+
+CACHE_REQUESTS = Counter("simpleshortener_cache_requests_total",
+                         "Lookups of the in-process caches",
+                         ["cache", "result"])
+
+CACHE_SIZE = Gauge("simpleshortener_cache_entries",
+                   "Number of entries of the in-process caches",
+                   ["cache"], multiprocess_mode="livesum")
+
+URL_FILTER_BYTES = Gauge("simpleshortener_url_filter_bytes",
+                         "Memory of the filter of the valid shorts",
+                         multiprocess_mode="livesum")
+
+STATISTICS_QUEUE = Gauge("simpleshortener_statistics_queue_events",
+                         "Statistics events waiting to be aggregated",
+                         multiprocess_mode="livesum")
+
+STATISTICS_EVENTS = Counter("simpleshortener_statistics_events_total",
+                            "Statistics events by outcome",
+                            ["result"])
+
+LOG_DROPPED = Counter("simpleshortener_log_records_dropped_total",
+                      "Log records dropped because the queue of the log writer was full")
+
+
+def timed(operation: str):
+    """
+    Decorator that records the latency of the function in LATENCY
+
+    :param operation: the label of the operation
+    :type operation: str
+    """
+    histogram = LATENCY.labels(operation)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return func(*args, **kwargs)
+
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedRedis(StrictRedis):
+    """
+    StrictRedis that records each round trip, commands and pipelines, labelled with the current endpoint
+    """
+
+    db_label = "redis"
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+
+        try:
+            return super(InstrumentedRedis, self).execute_command(*args, **options)
+
+        finally:
+            REDIS_ROUNDTRIPS.labels(ENDPOINT.get(), self.db_label).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        p = InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        p.db_label = self.db_label
+
+        return p
+
+
+class InstrumentedPipeline(Pipeline):
+    db_label = "redis"
+
+    def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+
+        try:
+            return super(InstrumentedPipeline, self).execute(raise_on_error)
+
+        finally:
+            REDIS_ROUNDTRIPS.labels(ENDPOINT.get(), self.db_label).observe(time.perf_counter() - start)
+
+
+def exposition() -> bytes:
+    """
+    Returns the metrics in the Prometheus text format, aggregated across the processes if it is enabled
+
+    :return: the body of the /metrics response
+    :rtype: bytes
+    """
+    if _MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry)
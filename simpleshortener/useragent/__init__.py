@@ -0,0 +1,112 @@
+__all__ = ["UserAgent", "UserAgentClassifier"]
+
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Pattern, Tuple
+
+
+class UserAgent(NamedTuple):
+    os: str
+    browser: str
+
+
+# An alternative of a pattern that is a plain string, matched with a substring search instead of the regex engine
+_LITERAL = re.compile(r"[a-z0-9 _/;:,=!-]+")
+
+
+class _Bucket(NamedTuple):
+    name: str
+    tokens: Tuple[str, ...]
+    regex: Optional[Pattern]
+
+
+def _compile(name: str, pattern: str) -> _Bucket:
+    """
+    Splits a pattern in plain strings if it is only an alternation of them, else compiles it
+    """
+    alternatives = pattern.split("|")
+
+    if all(_LITERAL.fullmatch(a) for a in alternatives):
+        return _Bucket(name, tuple(alternatives), None)
+
+    return _Bucket(name, (), re.compile(pattern))
+
+
+class UserAgentClassifier:
+    """
+    Classifies the user agent strings in operation system and browser buckets
+
+    The buckets of each list are tried in order on the lowercase string and the first one that matches wins,
+    like in a chain of if/elif, so a common user agent stops at its first buckets.
+    The patterns made only of plain alternatives are matched with substring searches, the others with a regex.
+    The crawlers and the link preview bots go in the "bot" bucket of both lists.
+    The results are cached by the raw user agent string since the real traffic repeats a few of them.
+    Subclasses can change the buckets overriding BOT, OS and BROWSER, the patterns must be lowercase.
+    """
+
+    # The most common tokens come first
+    BOT: str = r"bot|crawl|spider|preview|headless|facebookexternalhit|whatsapp|telegram|curl|wget|" \
+               r"python-requests|go-http-client|okhttp|slurp|embedly|skype"
+
+    OS: List[Tuple[str, str]] = [
+        ("windows", r"windows"),
+        ("mac", r"macintosh"),
+        ("ios", r"iphone|ipad|ipod"),
+        ("android", r"android"),
+        ("linux", r"linux")
+    ]
+
+    BROWSER: List[Tuple[str, str]] = [
+        ("edge", r"edg/|edge/|edgios|edga"),
+        ("opera", r"opr/|opera"),
+        ("samsung", r"samsungbrowser"),
+        ("firefox", r"firefox/|fxios"),
+        ("chrome", r"chrome/|crios|chromium"),
+        ("safari", r"safari/"),
+        ("ie", r"msie|trident/")
+    ]
+
+    OTHER = "other"
+
+    def __init__(self, cache_size: int = 4096):
+        self._bot = [_compile("bot", self.BOT)]
+        self._os = [_compile(name, pattern) for name, pattern in self.OS]
+        self._browser = [_compile(name, pattern) for name, pattern in self.BROWSER]
+
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, user_agent: Optional[str]) -> UserAgent:
+        """
+        Returns the buckets of the user agent
+
+        :param user_agent: a user agent string
+        :type user_agent: Optional[str]
+        :return: the operation system and the browser
+        :rtype: UserAgent
+        """
+        if not user_agent:
+            return UserAgent(self.OTHER, self.OTHER)
+
+        user_agent = user_agent.lower()
+
+        if self._first(self._bot, user_agent) is not self.OTHER:
+            return UserAgent("bot", "bot")
+
+        return UserAgent(self._first(self._os, user_agent), self._first(self._browser, user_agent))
+
+    def _first(self, buckets: List[_Bucket], user_agent: str) -> str:
+        """
+        Returns the name of the first bucket that matches the lowercase user agent, or OTHER
+        """
+        for name, tokens, regex in buckets:
+            if regex is not None:
+                if regex.search(user_agent) is not None:
+                    return name
+
+                continue
+
+            for token in tokens:
+                if token in user_agent:
+                    return name
+
+        return self.OTHER
@@ -1,23 +1,34 @@
+import gzip
+import hashlib
 import logging
+import math
+import time
 from os.path import join, dirname, abspath
-from typing import Union, Tuple
+from typing import Mapping, Optional, Union, Tuple
 
 import simplejson as simplejson
-from flask import Flask, abort, request, Response, render_template
+from flask import Flask, abort, g, request, Response, render_template
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import redirect
 
-from cooldown.exceptions import CooldownError
-from log import LoggerSetup
-from simpleshortener.simpleshortener import SimpleShortener
+from log import AccessLog, LoggerSetup
+from ratelimit.exceptions import RateLimitExceeded
+from simpleshortener import InvalidMetricsQuery, SimpleShortener, SyncFailed, SyncInProgress
+from telemetry import CONTENT_TYPE, ENDPOINT, exposition, timed
 
 # Retrieves logger
 _logger = logging.getLogger(__name__)
 
+# Min size in bytes of a response to be compressed
+_GZIP_MIN_SIZE = 1024
+
 
 class WebApp(Flask):
     def __init__(self,
                  log_level: Union[int, str] = logging.ERROR,
                  log_level_modules: Union[int, str] = logging.ERROR,
+                 access_log_sample_rate: float = 0.0,
+                 trusted_proxies: int = 0,
                  **kwargs):
         super(WebApp, self).__init__("simpleshortener",
                                      template_folder=join(dirname(abspath(__file__)), 'templates'),
@@ -25,17 +36,32 @@ class WebApp(Flask):
 
         # Init log
         LoggerSetup(["webapp", "simpleshortener"], log_level, log_level_modules=log_level_modules)
+        self._access_log = AccessLog(access_log_sample_rate, classifier=kwargs.get("user_agent_classifier"))
 
         # Init UUS
         self._ss = SimpleShortener(**kwargs)
 
+        # Takes the address of the client from X-Forwarded-For only behind the given number of proxies,
+        # otherwise a client could pick its own address
+        if int(trusted_proxies) > 0:
+            self.wsgi_app = ProxyFix(self.wsgi_app, x_for=int(trusted_proxies))
+
         # Sets url rules for api
         self.add_url_rule("/api/v2/sync", "sync", view_func=self._sync)
         self.add_url_rule("/api/v2/url_list", "url_list", view_func=self._url_list)
         self.add_url_rule("/api/v2/metrics", "get_metrics", view_func=self._get_metrics, methods=["GET", "POST"])
+        self.add_url_rule("/api/v2/metrics/bulk", "get_bulk_metrics", view_func=self._get_bulk_metrics,
+                          methods=["GET", "POST"])
+        self.add_url_rule("/api/v2/cache", "cache", view_func=self._cache)
+        self.add_url_rule("/api/v2/export", "export", view_func=self._export)
 
         # Sets special pages
         self.add_url_rule("/statistics", "statistics", view_func=self._statistics)
+        self.add_url_rule("/metrics", "metrics", view_func=self._metrics)
+
+        # Sets the probes, the process is alive as soon as it answers and ready when it can resolve the shorts
+        self.add_url_rule("/healthz", "healthz", view_func=lambda: "OK")
+        self.add_url_rule("/readyz", "readyz", view_func=self._readyz)
 
         # Sets a 404 for the favicon and robots.txt
         self.add_url_rule("/favicon.ico", "favicon.ico", view_func=lambda: abort(404))
@@ -44,45 +70,186 @@ class WebApp(Flask):
         # Sets short url
         self.add_url_rule("/<path:url>", "redirect", view_func=self._redirect)
 
+        # Labels the redis round trips with the endpoint of the request
+        self.before_request(self._label_endpoint)
+
+        # Logs a sample of the requests with their latency
+        self.before_request(self._start_timer)
+        self.after_request(self._log_access)
+
+        # Rejects the clients that exceeded the rate limit of the endpoint
+        self.before_request(self._rate_limit)
+
         _logger.info("The web app is ready")
 
-    def _sync(self) -> Union[str, Tuple[str, int]]:
+    @staticmethod
+    def _label_endpoint() -> None:
+        ENDPOINT.set(request.endpoint)
+
+    @staticmethod
+    def _start_timer() -> None:
+        g.started = time.perf_counter()
+
+    def _log_access(self, response: Response) -> Response:
+        if self._access_log.sampled():
+            self._access_log.log(request.endpoint, response.status_code, time.perf_counter() - g.started,
+                                 short=(request.view_args or {}).get("url") if request.endpoint == "redirect" else None,
+                                 user_agent=request.headers.get("User-Agent"))
+
+        return response
+
+    def _rate_limit(self) -> Optional[Response]:
+        # The syncs are limited across the deployment by SimpleShortener
+        if request.endpoint == "sync" or not self._ss.rate_limited(request.endpoint):
+            return None
+
+        try:
+            self._ss.check_rate_limit(request.endpoint, request.remote_addr)
+
+        except RateLimitExceeded as e:
+            return self._too_many_requests(e)
+
+    @staticmethod
+    def _too_many_requests(e: RateLimitExceeded) -> Response:
+        return Response(response="Too many requests in a short period", status=429,
+                        headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+    def _sync(self) -> Union[str, Response, Tuple[str, int]]:
         # Tries to sync the url db
         try:
             self._ss.sync()
             return "Done"
 
-        except CooldownError:
-            return "Too many requests in a short period", 503
+        except RateLimitExceeded as e:
+            return self._too_many_requests(e)
+
+        except SyncInProgress:
+            return "A sync is already in progress", 409
 
-        except SyntaxError as e:
+        except SyncFailed as e:
             return "An error has occurred ({})".format(e.__class__.__name__), 503
 
     def _url_list(self):
+        return self._json_response(self._ss.get_url_list())
+
+    def _cache(self):
         return Response(
-            response=simplejson.dumps(self._ss.get_url_list()),
+            response=simplejson.dumps(self._ss.get_cache_stats()),
             status=200,
             mimetype="application/json")
 
+    def _readyz(self):
+        status = self._ss.get_status()
+
+        return Response(
+            response=simplejson.dumps(status),
+            status=200 if status["ready"] else 503,
+            mimetype="application/json")
+
     def _get_metrics(self):
-        if request.json is not None and "url" in request.json:
-            return Response(
-                response=simplejson.dumps(self._ss.get_metrics(request.json["url"])),
-                mimetype="application/json")
+        data = request.get_json(silent=True)
+
+        if not isinstance(data, dict) or "url" not in data:
+            data = request.args
+
+        if "url" not in data:
+            return abort(403)
+
+        try:
+            return self._json_response(self._ss.get_metrics(data["url"], **self._metrics_options(data)))
 
-        if request.args is not None and  "url" in request.args:
-            return Response(
-                response=simplejson.dumps(self._ss.get_metrics(request.args["url"])),
-                mimetype="application/json")
+        except InvalidMetricsQuery as e:
+            return str(e), 400
 
-        return abort(403)
+    def _get_bulk_metrics(self):
+        data = request.get_json(silent=True)
+
+        if isinstance(data, dict) and "url" in data:
+            urls = data["url"]
+
+        else:
+            data = request.args
+            urls = data.getlist("url")
+
+            # The query string lists each url in its own url parameter
+            if urls == ["all"]:
+                urls = "all"
+
+        if not urls:
+            return abort(403)
+
+        try:
+            return self._json_response(self._ss.get_bulk_metrics(urls, **self._metrics_options(data)))
+
+        except InvalidMetricsQuery as e:
+            return str(e), 400
+
+    @staticmethod
+    def _metrics_options(data: Mapping) -> dict:
+        """
+        Gets the options of a metrics query from the json body or the query string
+        """
+        options = {k: data[k] for k in ("start", "end", "granularity") if k in data}
+
+        if "breakdown" in data:
+            options["breakdown"] = str(data["breakdown"]).lower() not in ("0", "false", "no")
+
+        return options
+
+    @staticmethod
+    def _json_response(data) -> Response:
+        """
+        Returns the data as json with an ETag, compressed with gzip if the client accepts it
+        The client gets a 304 if it has already the same data
+        """
+        body = simplejson.dumps(data).encode()
+
+        compress = len(body) >= _GZIP_MIN_SIZE and "gzip" in request.accept_encodings
+
+        # The compressed representation has its own tag
+        etag = hashlib.sha1(body).hexdigest() + ("-gzip" if compress else "")
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+
+        else:
+            response = Response(response=gzip.compress(body, 6) if compress else body,
+                                mimetype="application/json")
+            if compress:
+                response.headers["Content-Encoding"] = "gzip"
+
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+
+        return response
+
+    def _export(self):
+        try:
+            chunks = self._ss.export_statistics(request.args.get("since"))
+
+        except InvalidMetricsQuery as e:
+            return str(e), 400
+
+        # Streams a json line for each record as the chunks are read
+        return Response(response=("".join(simplejson.dumps(r) + "\n" for r in records) for records in chunks),
+                        mimetype="application/x-ndjson")
+
+    def _metrics(self):
+        return Response(
+            response=exposition(),
+            status=200,
+            content_type=CONTENT_TYPE)
 
+    @timed("redirect")
     def _redirect(self, url: str):
         try:
             u = self._ss.get_url(url)
 
-            # TODO: Move statistics update to another thread
-            self._ss.update_url_statistics(url, user_agent=request.headers.get('User-Agent'))
+            # The client is the peer address, taken from X-Forwarded-For only behind the trusted proxies
+            self._ss.update_url_statistics(url,
+                                           user_agent=request.headers.get('User-Agent'),
+                                           client=request.remote_addr)
 
             return redirect(u)
         except:
@@ -3,6 +3,7 @@
 
 export const COLOR = {
 	total: "#444",
+	uniques: "#e91e63",
 	user_agent: {
 		"linux": "#ffc500",
 		"windows": "#00a4ef",
@@ -75,6 +75,20 @@ export default class MetricsProcessor {
 				dataset.data.push(d in metrics ? metrics[d]["total"] : 0);
 			});
 			data.datasets.push(dataset);
+
+			let uniques = {
+				type: "line",
+				label: "uniques",
+				lineTension: 0,
+				borderColor: COLOR.uniques,
+				borderDash: [5, 5],
+				backgroundColor: "rgba(0,0,0,0)",
+				data: []
+			};
+			days.forEach(d => {
+				uniques.data.push(d in metrics ? metrics[d]["uniques"] : 0);
+			});
+			data.datasets.push(uniques);
 		}
 
 		shortUrl.forEach(u => {
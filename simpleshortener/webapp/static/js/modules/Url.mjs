@@ -42,14 +42,19 @@ export class TargetUrl extends Url {
 		}
 	}
 
-	loadStatistics(callback = null) {
-		fetch('./api/v2/metrics', {
+	loadStatistics(callback = null, period = {}) {
+		//A GET lets the browser revalidate the cached metrics and get a 304 when they haven't changed
+		let query = new URLSearchParams({url: this.url, breakdown: "true"});
+		["start", "end", "granularity"].forEach((k) => {
+			if (period[k])
+				query.set(k, period[k]);
+		});
+
+		fetch('./api/v2/metrics?' + query.toString(), {
 			headers: {
-				'Accept': 'application/json',
-				'Content-Type': 'application/json'
+				'Accept': 'application/json'
 			},
-			method: "POST",
-			body: JSON.stringify({url: this.url})
+			method: "GET"
 		}).then((res) => {
 			if (res.headers.get("content-type") && res.headers.get("content-type").includes("application/json")) {
 				return res.json();
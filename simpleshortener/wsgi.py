@@ -3,13 +3,12 @@ import os
 from webapp import WebApp
 
 
-def gunicorn_entry():
+def load_env() -> dict:
     """
-    Entry point for Gunicorn
-    It retrieves the option from envs and return an initialized instance of WebApp
+    Retrieves the options of the service from envs
 
-    :return an initialized instance of WebApp
-    :rtype WebApp
+    :return the options that are set
+    :rtype dict
     """
 
     env = {}
@@ -18,12 +17,36 @@ def gunicorn_entry():
     env["url_file_expiration"] = os.getenv("SS_URL_EXPIRATION")
     env["redis_url"] = os.getenv("SS_REDIS_URL")
     env["redis_statistics"] = os.getenv("SS_REDIS_STATISTICS")
+    env["url_file_timeout"] = os.getenv("SS_URL_FILE_TIMEOUT")
     env["statistics_expiration"] = os.getenv("SS_STATISTICS_EXPIRATION")
+    env["url_cache_size"] = os.getenv("SS_URL_CACHE_SIZE")
+    env["url_cache_ttl"] = os.getenv("SS_URL_CACHE_TTL")
+    env["statistics_flush_interval"] = os.getenv("SS_STATISTICS_FLUSH_INTERVAL")
+    env["statistics_flush_size"] = os.getenv("SS_STATISTICS_FLUSH_SIZE")
+    env["statistics_queue_size"] = os.getenv("SS_STATISTICS_QUEUE_SIZE")
+    env["sync_lock_ttl"] = os.getenv("SS_SYNC_LOCK_TTL")
+    env["redis_max_connections"] = os.getenv("SS_REDIS_MAX_CONNECTIONS")
+    env["metrics_cache_ttl"] = os.getenv("SS_METRICS_CACHE_TTL")
+    env["url_filter_error_rate"] = os.getenv("SS_URL_FILTER_ERROR_RATE")
+    env["url_snapshot"] = os.getenv("SS_URL_SNAPSHOT")
+    env["rate_limits"] = os.getenv("SS_RATE_LIMITS")
+    env["trusted_proxies"] = os.getenv("SS_TRUSTED_PROXIES")
     env["log_level"] = os.getenv("SS_LOG_LEVEL")
     env["log_level_modules"] = os.getenv("SS_LOG_LEVEL_MODULES")
+    env["access_log_sample_rate"] = os.getenv("SS_ACCESS_LOG_SAMPLE_RATE")
 
     # Remove None env
-    env = {k: env[k] for k in env if env[k] is not None}
+    return {k: env[k] for k in env if env[k] is not None}
+
+
+def gunicorn_entry():
+    """
+    Entry point for Gunicorn
+    It retrieves the option from envs and return an initialized instance of WebApp
+
+    :return an initialized instance of WebApp
+    :rtype WebApp
+    """
 
     # Return initialized WebApp
-    return WebApp(**env)
+    return WebApp(**load_env())